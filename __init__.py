@@ -1 +1 @@
-from .FastValveMaterial import *
\ No newline at end of file
+from .fvm_core import *
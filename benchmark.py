@@ -0,0 +1,354 @@
+""" Stage benchmarks for FastValveMaterial
+
+Generates synthetic PBR material sets and times every conversion stage on
+its own. Results are written as JSON so runs from different commits can be
+compared with --compare. Runs offline: without VTFLib the built-in numpy
+encoder is used, and "--backend null" skips encoding altogether.
+
+With --startup it times whole command line runs in new processes instead:
+one with nothing to convert and one where every material is up to date, both
+of which should stay well under STARTUP_BUDGET once their bytecode is cached.
+The same runs without cached bytecode ("_cold") are reported next to them.
+
+Usage:
+    python benchmark.py --sizes 512 1024 2048 --output bench.json
+    python benchmark.py --sizes 512 1024 --compare bench.json
+    python benchmark.py --startup --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+import fvm_core as FVM
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ("separate", "orm", "gloss", "missing")
+STARTUP_STAGES = ("interpreter", "empty", "up_to_date", "empty_cold", "up_to_date_cold") # Bare "python -c pass" for reference, then the runs that should convert nothing, with cached bytecode and without
+BUDGET_STAGES = ("empty", "up_to_date") # Cold starts are reported, but only happen once per install unless bytecode caching is off
+STARTUP_BUDGET = 0.1 # Seconds the empty and up to date runs with cached bytecode may take on top of starting the interpreter
+STARTUP_RUNS = 5 # Minimum runs per startup stage, single process starts are noisy
+STAGES = ("discovery", "decode", "resize", "bundle", "do_diffuse", "do_exponent", "do_normal", "export_texture", "vmt")
+RSS_INTERVAL = 0.002 # Seconds between memory samples while a stage runs
+
+def get_peak_rss_mb(): # High-water mark of the whole process, only meaningful because every material runs in a new one
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10) # Bytes on macOS, KB on Linux
+
+def get_rss_mb(): # Current resident memory, None where /proc isn't available
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class RSSSampler: # Samples the resident memory in a thread while a stage runs, the peak of one stage doesn't leak into the next
+    def __init__(self):
+        self.start = get_rss_mb()
+        self.peak = self.start
+        self.stopped = threading.Event()
+        self.thread = None
+        if self.start is not None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, get_rss_mb())
+
+    def stop(self): # (peak, peak minus the memory at the start) in MB, falls back to the process' high-water mark without /proc
+        if self.thread is None:
+            return get_peak_rss_mb(), None
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, get_rss_mb())
+        return self.peak, self.peak - self.start
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def make_map(size, seed, channels): # Smooth noise with some detail, compresses and converts like a real texture would
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(2, size // 64), max(2, size // 64), channels), dtype=np.uint8)
+    image = Image.fromarray(coarse.squeeze(), 'L' if channels == 1 else 'RGB').resize((size, size), Image.BICUBIC)
+    detail = rng.integers(-12, 13, (size, size, channels), dtype=np.int16).squeeze()
+    return Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + detail, 0, 255).astype(np.uint8))
+
+def make_material_set(folder, name, size, scenario): # Write the source maps of one synthetic material, the AO and metal maps are half size to exercise the resizing
+    maps = {"_c": (size, 3), "_n": (size, 3)}
+    if scenario == "orm":
+        maps["_r"] = (size, 3)
+    elif scenario == "missing": # Only color and roughness, everything else falls back to the defaults
+        maps = {"_c": (size, 3), "_r": (size, 1)}
+    else:
+        maps.update({"_a": (size // 2, 1), "_r": (size, 1), "_m": (size // 2, 1)})
+    for seed, (suffix, (map_size, channels)) in enumerate(sorted(maps.items())):
+        make_map(map_size, seed, channels).save(os.path.join(folder, name + suffix + ".png"))
+
+def make_config(input_path, output_path, scenario, backend):
+    config = FVM.get_default_config()
+    config["Paths"]["InputPath"] = input_path
+    config["Paths"]["OutputPath"] = output_path
+    config["Paths"]["MaterialName"] = ""
+    config["Paths"]["InputFileExtension"] = "png"
+    config["Paths"]["RecursiveInput"] = "False"
+    config["ImageConfig"]["ORMTextureMode"] = str(scenario == "orm")
+    config["ImageConfig"]["RoughOrGloss"] = "gloss" if scenario == "gloss" else "rough"
+    config["ImageConfig"]["TileBudgetMB"] = "0"
+    config["ImageConfig"]["VTFBackend"] = "auto" if backend == "null" else backend
+    config["Debug"]["DebugMessages"] = "False"
+    if scenario == "missing":
+        for suffix in ("AO", "Normal", "Metal"):
+            config["ImageSuffixes"][suffix] = ""
+    return config
+
+def make_settings(input_path, output_path, scenario, backend):
+    return FVM.get_settings(make_config(input_path, output_path, scenario, backend))
+
+class StageRecorder: # Times stages and records throughput and memory for each of them
+    def __init__(self, scenario, size, trace_memory):
+        self.scenario = scenario
+        self.size = size
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def measure(self, stage, pixels, function, *args):
+        if self.trace_memory:
+            tracemalloc.start()
+        sampler = RSSSampler()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = function(*args)
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        peak_rss, rss_delta = sampler.stop()
+        traced_peak = None
+        if self.trace_memory:
+            traced_peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            tracemalloc.stop()
+        self.results.append({
+            "scenario": self.scenario,
+            "size": self.size,
+            "stage": stage,
+            "seconds": wall,
+            "cpu_seconds": cpu,
+            "megapixels_per_second": pixels / 1e6 / wall if pixels and wall > 0 else None,
+            "peak_rss_mb": peak_rss,
+            "rss_delta_mb": rss_delta,
+            "peak_traced_mb": traced_peak,
+        })
+        return result
+
+def benchmark_material(scenario, size, backend, trace_memory): # Run every stage once on a fresh synthetic material
+    # Called through run_isolated, so the memory numbers only contain this material
+    recorder = StageRecorder(scenario, size, trace_memory)
+    pixels = size * size
+    with tempfile.TemporaryDirectory(prefix="fvm_bench_") as root:
+        input_path = os.path.join(root, "images")
+        output_path = os.path.join(root, "materials", "bench")
+        os.makedirs(input_path)
+        os.makedirs(output_path)
+        make_material_set(input_path, "bench", size, scenario)
+        settings = make_settings(input_path, output_path, scenario, backend)
+        FVM.apply_settings(settings)
+
+        def discover():
+            index = FVM.get_directory_index(settings)
+            return {name: FVM.find_material_textures(name, settings, index) for name in FVM.find_material_names(index, "", settings["suffixes"]["color"])}
+        textures = recorder.measure("discovery", None, discover)["bench"]
+
+        def decode():
+            images = {}
+            for role, path in textures.items():
+                if path:
+                    images[role] = Image.open(path)
+                    images[role].load()
+            return images
+        decoded_pixels = 0
+        for path in textures.values():
+            if path:
+                with Image.open(path) as image: # Only reads the header
+                    decoded_pixels += image.width * image.height
+        images = recorder.measure("decode", decoded_pixels, decode)
+
+        reference = images.get("normal", images["color"])
+        mismatched = [image for image in images.values() if image.size != reference.size]
+        recorder.measure("resize", sum(reference.width * reference.height for _ in mismatched),
+                         lambda: [FVM.fix_scale_mismatch(reference, image) for image in mismatched])
+
+        def make_bundle(): # Decode, resize and convert everything the generators read, like convert_material does
+            bundle = FVM.TextureBundle(textures, settings)
+            for role, mode in (("color", "RGB"), ("ao", "RGB"), ("gloss", "RGB"), ("gloss", "RGBA"), ("metal", "L"), ("normal", "RGBA")):
+                if bundle.has(role):
+                    bundle.get(role, mode)
+            return bundle
+        bundle = recorder.measure("bundle", pixels, make_bundle)
+
+        exported = {}
+        def capture_texture(texture, path, imageFormat=None, mip_mode=None): # Stand-in so the generator stages don't include the encoding
+            exported[os.path.basename(path)] = (np.asarray(texture), imageFormat, mip_mode)
+        export_texture = FVM.export_texture
+        FVM.export_texture = capture_texture
+        try:
+            recorder.measure("do_diffuse", pixels, FVM.do_diffuse, bundle, settings["metallic_factor"], "bench", output_path)
+            recorder.measure("do_exponent", pixels, FVM.do_exponent, bundle, settings["clear_exponent"], settings["force_compression"], "bench", output_path)
+            recorder.measure("do_normal", pixels, FVM.do_normal, settings["midtone"], bundle, settings["force_compression"], False, "bench", output_path, settings["gamma_all_pixels"])
+        finally:
+            FVM.export_texture = export_texture
+
+        if backend != "null":
+            with tempfile.TemporaryDirectory(dir=root) as work_dir:
+                def export_all():
+                    for file_name, (texture, image_format, mip_mode) in exported.items():
+                        FVM.export_texture(texture, os.path.join(work_dir, file_name), image_format, mip_mode)
+                recorder.measure("export_texture", pixels * len(exported), export_all)
+
+        recorder.measure("vmt", None, FVM.do_material, "bench", settings)
+    return recorder.results
+
+def run_isolated(function, *args): # Call "function" in a new interpreter, which starts with none of the memory earlier materials used
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+def copy_scripts(destination): # Copy the modules a command line run uses, so their bytecode gets cached next to the copies instead of in the repo
+    source = os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(destination)
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if name.endswith(".py") or name == "phongwarp_steel.vtf":
+            shutil.copy2(path, destination)
+        elif name == "VTFLibWrapper" and os.path.isdir(path):
+            shutil.copytree(path, os.path.join(destination, name), ignore=shutil.ignore_patterns("__pycache__"))
+    return os.path.join(destination, "FastValveMaterial.py")
+
+def benchmark_startup(runs, backend): # Time new processes that have nothing to convert, "runs" times per stage
+    # Cold runs compile the modules every time (-B, and a copy that never had bytecode), like with PYTHONDONTWRITEBYTECODE set
+    # Cached runs use the bytecode their first run wrote, like every run after the first one of a normal install
+    env = {name: value for name, value in os.environ.items() if name not in ("PYTHONDONTWRITEBYTECODE", "PYTHONPYCACHEPREFIX")}
+    results = []
+    with tempfile.TemporaryDirectory(prefix="fvm_bench_") as root:
+        scripts = {"cold": copy_scripts(os.path.join(root, "cold")), "cached": copy_scripts(os.path.join(root, "cached"))}
+        commands = {"interpreter": [sys.executable, "-c", "pass"]}
+        for stage, material in (("empty", None), ("up_to_date", "bench")):
+            input_path = os.path.join(root, stage)
+            os.makedirs(input_path)
+            if material:
+                make_material_set(input_path, material, 256, "separate")
+            config = make_config(input_path, os.path.join(root, "materials", stage), "separate", "auto" if backend == "null" else backend)
+            config_path = os.path.join(root, stage + ".ini")
+            with open(config_path, 'w') as f:
+                config.write(f)
+            commands[stage] = [sys.executable, scripts["cached"], "--config", config_path]
+            commands[stage + "_cold"] = [sys.executable, "-B", scripts["cold"], "--config", config_path]
+            subprocess.run(commands[stage], stdout=subprocess.DEVNULL, env=env, check=True) # Converts the material, so the timed runs find it up to date, and caches the bytecode
+        for stage in STARTUP_STAGES:
+            for _ in range(max(runs, STARTUP_RUNS)):
+                start_cpu = sum(os.times()[2:4]) # User and system time of finished child processes
+                start_wall = time.perf_counter()
+                subprocess.run(commands[stage], stdout=subprocess.DEVNULL, env=env, check=True)
+                wall = time.perf_counter() - start_wall
+                results.append({
+                    "scenario": "startup",
+                    "size": 0,
+                    "stage": stage,
+                    "seconds": wall,
+                    "cpu_seconds": sum(os.times()[2:4]) - start_cpu,
+                    "megapixels_per_second": None,
+                    "peak_rss_mb": None,
+                    "rss_delta_mb": None,
+                    "peak_traced_mb": None,
+                })
+    return results
+
+def best_of(runs): # Keep the fastest run of every stage, the others mostly measure noise
+    best = {}
+    for result in runs:
+        key = (result["scenario"], result["size"], result["stage"])
+        if key not in best or result["seconds"] < best[key]["seconds"]:
+            best[key] = result
+    return list(best.values())
+
+def compare(results, baseline_path): # Print the speed of every stage relative to an earlier result file
+    with open(baseline_path, 'r') as f:
+        baseline = {(result["scenario"], result["size"], result["stage"]): result for result in json.load(f)["results"]}
+    print(f"{'scenario':<10}{'size':>6}  {'stage':<16}{'before':>10}{'after':>10}{'speedup':>9}")
+    for result in results:
+        old = baseline.get((result["scenario"], result["size"], result["stage"]))
+        if old is None:
+            continue
+        speedup = old["seconds"] / result["seconds"] if result["seconds"] > 0 else float("inf")
+        print(f"{result['scenario']:<10}{result['size']:>6}  {result['stage']:<16}{old['seconds']:>10.4f}{result['seconds']:>10.4f}{speedup:>8.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FastValveMaterial conversion stages on synthetic materials")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048], help="Texture sizes to test, e.g. 512 1024 2048 4096 8192")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--backend", choices=("auto", "vtflib", "numpy", "null"), default="auto", help="VTF backend, \"null\" skips the export stage")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per material, the fastest one is kept")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record the peak allocation of every stage with tracemalloc (slower)")
+    parser.add_argument("--startup", action="store_true", help="Time whole runs that have nothing to convert instead of the stages, exits with 1 if they go over STARTUP_BUDGET")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="Earlier JSON result file to compare against")
+    args = parser.parse_args()
+
+    runs = []
+    if args.startup:
+        runs.extend(benchmark_startup(args.repeat, args.backend))
+        print("[FVM] Benchmarked startup")
+    else:
+        for size in args.sizes:
+            for scenario in args.scenarios:
+                for _ in range(max(1, args.repeat)):
+                    runs.extend(run_isolated(benchmark_material, scenario, size, args.backend, args.trace_memory))
+                print(f"[FVM] Benchmarked '{scenario}' at {size}x{size}")
+    results = best_of(runs)
+
+    report = {
+        "version": FVM.VERSION,
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "backend": args.backend if args.backend == "null" else FVM.get_vtf_backend(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+    else:
+        for result in results:
+            throughput = f"{result['megapixels_per_second']:9.1f} MP/s" if result["megapixels_per_second"] else " " * 14
+            memory = f"{result['peak_rss_mb'] or 0:8.1f} MB" + (f" (+{result['rss_delta_mb']:.1f})" if result["rss_delta_mb"] is not None else "")
+            print(f"{result['scenario']:<10}{result['size']:>6}  {result['stage']:<16}{result['seconds']:>9.4f}s {throughput}  {memory}")
+    startup = {result["stage"]: result["seconds"] for result in results if result["scenario"] == "startup"}
+    slow = [stage for stage in BUDGET_STAGES if stage in startup and startup[stage] - startup["interpreter"] > STARTUP_BUDGET]
+    if slow:
+        print(f"[FVM] [ERROR] Startup over the {STARTUP_BUDGET * 1000:.0f} ms budget: {', '.join(slow)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
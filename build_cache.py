@@ -0,0 +1,129 @@
+""" Incremental rebuild manifest for FastValveMaterial
+
+Stores the content hash of every source map and a key per generated output
+in the output folder, so unchanged materials (or single outputs of them) can
+be skipped and outputs of removed materials can be pruned.
+"""
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = ".fvm_manifest.json"
+MANIFEST_VERSION = 1
+
+def hash_file(path): # Content hash of a file, read in chunks so big textures don't need to fit in memory twice
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def hash_inputs(textures, old_inputs=None): # Hash every source map, reusing the old hash if size and modification time didn't change
+    old_inputs = old_inputs or {}
+    inputs = {}
+    for role, path in textures.items():
+        if path is None:
+            continue
+        stat = os.stat(path)
+        old = old_inputs.get(role)
+        if old and old["path"] == path and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime_ns:
+            inputs[role] = old
+        else:
+            inputs[role] = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": hash_file(path)}
+    return inputs
+
+def inputs_unchanged(textures, old_inputs): # True if hash_inputs would reuse every old hash, so planning doesn't read any file
+    paths = {role: path for role, path in textures.items() if path is not None}
+    if not old_inputs or set(paths) != set(old_inputs):
+        return False
+    for role, path in paths.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        old = old_inputs[role]
+        if old["path"] != path or old["size"] != stat.st_size or old["mtime"] != stat.st_mtime_ns:
+            return False
+    return True
+
+def get_output_dependencies(output, settings, textures): # The source maps and settings that feed into a single output
+    sources = []
+    if output in ("diffuse", "exponent", "normal"):
+        # Everything gets scaled to the normal map, or to the color map if there is no normal map
+        sources += ["normal"] if textures.get("normal") else ["color"]
+        keys = ["vtf_backend", "mip_filter", "mip_correction", "texture_store"] # Switching DedupTextures or moving the store relinks the textures
+    if output == "diffuse":
+        sources += ["color", "metal", "orm"]
+        if textures.get("ao") or textures.get("orm"):
+            sources += ["ao"]
+            keys += ["metallic_factor"]
+        else: # Without an AO map the gloss map gets blended into the diffuse
+            sources += ["roughness"]
+            keys += ["metallic_factor", "material_setup"]
+    elif output == "exponent":
+        sources += ["roughness", "orm"]
+        keys += ["material_setup", "clear_exponent", "force_compression"]
+    elif output == "normal":
+        sources += ["roughness", "orm"]
+        keys += ["material_setup", "midtone", "gamma_all_pixels", "force_compression", "export_images"]
+    elif output == "material":
+        keys = ["output_path", "clear_exponent", "material_proxies", "phongwarps", "metallic_factor", "midtone", "material_template", "templates_hash"]
+    return [source for source in dict.fromkeys(sources) if source in textures], keys
+
+def get_output_key(output, settings, textures, inputs, version): # Hash of everything an output depends on
+    sources, keys = get_output_dependencies(output, settings, textures)
+    key = {
+        "version": version,
+        "sources": {source: inputs[source]["hash"] if source in inputs else None for source in sources},
+        "settings": {name: settings[name] for name in keys},
+    }
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+def plan_material(record, settings, textures, output_files, version, old_inputs=None): # Work out which outputs are out of date, returns (outputs to regenerate, new manifest record)
+    inputs = hash_inputs(textures, old_inputs)
+    keys = {output: get_output_key(output, settings, textures, inputs, version) for output in output_files}
+    old_outputs = (record or {}).get("outputs", {})
+    stale = set()
+    for output, path in output_files.items():
+        old = old_outputs.get(output)
+        if not old or old["key"] != keys[output] or old["path"] != path or not os.path.exists(path):
+            stale.add(output)
+    new_record = {
+        "inputs": inputs,
+        "outputs": {output: {"path": path, "key": keys[output]} for output, path in output_files.items()},
+    }
+    return stale, new_record
+
+def get_manifest_path(output_path):
+    return os.path.join(output_path, MANIFEST_NAME)
+
+def load_manifest(output_path):
+    try:
+        with open(get_manifest_path(output_path), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION, "materials": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "materials": {}}
+    return manifest
+
+def dump_manifest(manifest): # Text of the manifest, written to get_manifest_path with fvm_core.write_output like every other output
+    # That goes through a unique temporary file, so an interrupted run never leaves a broken manifest behind and two runs on the same folder don't collide
+    return json.dumps(manifest, indent=1, sort_keys=True)
+
+def get_stale_files(old_record, new_record=None): # Output files of "old_record" that "new_record" doesn't produce anymore
+    new_paths = {output["path"] for output in (new_record or {}).get("outputs", {}).values()}
+    return [output["path"] for output in old_record.get("outputs", {}).values() if output["path"] not in new_paths]
+
+def prune(manifest, material_names): # Delete the outputs of materials that are no longer in the input folder, returns the deleted files
+    removed = []
+    for name in list(manifest["materials"]):
+        if name in material_names:
+            continue
+        for path in get_stale_files(manifest["materials"][name]):
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+        del manifest["materials"][name]
+    return removed
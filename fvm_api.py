@@ -0,0 +1,139 @@
+""" Library API for FastValveMaterial
+
+Converts materials inside the calling process, without a config file and
+without writing anything unless asked to. ConversionSettings holds the same
+values as the config file (already parsed), convert_material returns the
+generated files as bytes (or the texture arrays before encoding).
+
+    settings = ConversionSettings(output_path="materials/models/props/")
+    files = convert_material("crate", {"color": "crate_c.png", "normal": "crate_n.png", ...}, settings)
+    files["diffuse"] # Bytes of crate_c.vtf
+
+The module wide options of fvm_core (debug messages, VTF backend,
+tile budget) are set from the settings on every call, so calls with different
+settings shouldn't run in threads of the same process at once. The job server
+(job_server.py) runs every job in a worker process for that reason.
+"""
+
+import os
+import traceback
+from dataclasses import dataclass, field, asdict, fields
+
+try:
+    import fvm_core as FVM
+except ImportError:
+    from . import fvm_core as FVM
+
+def default_suffixes():
+    return {"color": "_c", "ao": "_a", "normal": "_n", "roughness": "_r", "metal": "_m"}
+
+@dataclass
+class ConversionSettings: # Parsed conversion options, the fields match the keys of fvm_core.get_settings
+    input_path: str = "images/"
+    output_path: str = "fastvalvematerial/" # Needs to contain a "materials" folder for the VMT
+    mat_name: str = ""
+    input_extensions: list = field(default_factory=lambda: ["png"])
+    recursive_input: bool = False
+    suffixes: dict = field(default_factory=default_suffixes) # Empty suffixes mark maps that aren't used
+    midtone: int = 235
+    gamma_all_pixels: bool = False
+    export_images: bool = False
+    material_setup: str = "rough" # "rough" or "gloss"
+    force_compression: bool = True
+    clear_exponent: bool = False
+    metallic_factor: float = 210/255*0.83
+    material_proxies: bool = False
+    orm: bool = False
+    phongwarps: bool = True
+    material_template: str = "" # Empty picks "pbr" or "normalized", see vmt_templates
+    template_path: str = "" # Folder with user templates
+    vtf_backend: str = "auto"
+    tile_budget: int = 0 # Bytes
+    mip_filter: str = "box" # See resample.FILTERS
+    mip_correction: bool = False
+    dedup_textures: bool = False # Duplicates become hard links to one file in the texture store
+    texture_store_path: str = "" # Empty keeps the store next to the "materials" folder of the output path
+    vpk_path: str = "" # Only used by run_conversion
+    vpk_chunk_size: int = 0 # Bytes
+    debug_messages: bool = False
+    print_config: bool = False
+    profile: bool = False
+
+    @classmethod
+    def from_settings(cls, settings): # From a fvm_core.get_settings dict, unknown keys are ignored
+        names = {f.name for f in fields(cls)}
+        values = {key: value for key, value in settings.items() if key in names}
+        if "midtone" in values:
+            values["midtone"] = int(values["midtone"])
+        return cls(**values)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls.from_settings(FVM.get_settings(config))
+
+    @classmethod
+    def from_config_file(cls, config_path):
+        return cls.from_config(FVM.get_config(config_path))
+
+    def as_settings(self): # The dict the rest of FastValveMaterial works with
+        settings = asdict(self)
+        settings["midtone"] = str(self.midtone) # Like the config value, so manifest keys match runs from the command line
+        return settings
+
+def get_settings(settings): # Accept a ConversionSettings or a settings dict
+    if isinstance(settings, ConversionSettings):
+        return settings.as_settings()
+    return ConversionSettings.from_settings(settings).as_settings()
+
+def get_textures(name, textures, settings): # Fill in the roles a material needs, or look all of them up in the input folder
+    if textures is None:
+        return FVM.find_material_textures(name, settings, FVM.get_directory_index(settings))
+    roles = ("color", "normal", "orm") if settings["orm"] else ("color", "ao", "normal", "roughness", "metal")
+    return {role: textures.get(role) for role in roles}
+
+def convert_material(name, textures=None, settings=None, outputs=None, encode=True):
+    """ Convert a single material in memory and return {output: data}
+
+    "textures" maps the roles of find_material_textures ("color", "ao", "normal",
+    "roughness", "metal", or "color", "normal", "orm" in ORM mode) to image
+    paths, missing roles are treated as unset. Without it, the maps are looked
+    up in settings.input_path. "outputs" limits which of "diffuse", "exponent",
+    "normal" and "material" are generated. The textures are returned as VTF
+    bytes, or as RGBA arrays with encode=False, the material as VMT bytes.
+    """
+    settings = get_settings(settings or ConversionSettings())
+    FVM.apply_settings(settings)
+    output_files = FVM.get_output_files(name, settings)
+    outputs = set(output_files) if outputs is None else set(outputs)
+    textures = get_textures(name, textures, settings)
+
+    results = {}
+    texture_outputs = [output for output in ("diffuse", "exponent", "normal") if output in outputs]
+    if texture_outputs:
+        bundle = FVM.TextureBundle(textures, settings)
+        makers = {
+            "diffuse": FVM.diffuse_tiles(bundle, settings["metallic_factor"]),
+            "exponent": FVM.exponent_tiles(bundle, settings["clear_exponent"]),
+            "normal": FVM.normal_tiles(bundle, settings["midtone"], settings["gamma_all_pixels"]),
+        }
+        formats = FVM.get_texture_formats(settings["force_compression"])
+        for output in texture_outputs:
+            texture = makers[output](slice(0, bundle.size[1]))
+            results[output] = FVM.encode_texture(texture, formats[output], FVM.MIP_MODES.get(output)) if encode else texture
+    if "material" in outputs:
+        results["material"] = FVM.get_material_text(name, settings).encode()
+    return results
+
+def convert_material_job(name, settings, textures=None, outputs=None, write=True): # Job server entry point, runs in a worker process and never raises
+    try:
+        settings = get_settings(settings)
+        if write: # The same path as the command line, incremental manifest aside
+            FVM.apply_settings(settings)
+            FVM.reset_output_cache() # Workers live on between jobs, the output folder may be gone by now
+            FVM.convert_material(name, settings, None if outputs is None else set(outputs), get_textures(name, textures, settings))
+            files = FVM.get_output_files(name, settings)
+            return {"error": None, "files": {output: os.path.abspath(path) for output, path in files.items() if outputs is None or output in outputs}}
+        return {"error": None, "data": convert_material(name, textures, settings, outputs)}
+    except Exception as e:
+        FVM.debug(traceback.format_exc())
+        return {"error": f"{type(e).__name__}: {e}"}
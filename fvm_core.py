@@ -0,0 +1,1126 @@
+""" Simple Source Material "PBR" generator
+
+Prerequisites (Python 3.x):
+pillow, numpy
+
+This is the converter itself, FastValveMaterial.py only starts it so the
+bytecode of this file can be cached.
+
+
+MIT License
+
+Copyright (c) 2022 Marvin Friedrich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE. """
+
+import os
+import sys
+import math
+import configparser
+import argparse
+import importlib.util
+import hashlib
+import time
+from contextlib import contextmanager
+
+def lazy_import(name, package=None): # Module that only gets executed on first attribute access, so runs with nothing to convert never pay for numpy and PIL
+    name = importlib.util.resolve_name(name, package)
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+futures = lazy_import("concurrent.futures")
+pathlib = lazy_import("pathlib")
+pprint = lazy_import("pprint")
+shutil = lazy_import("shutil")
+tempfile = lazy_import("tempfile")
+traceback = lazy_import("traceback")
+
+try:
+    import build_cache
+    import profiler
+    import vmt_templates
+except ImportError:
+    from . import build_cache, profiler, vmt_templates
+
+try: # The encoder modules import numpy themselves
+    vtf_writer = lazy_import("vtf_writer")
+    vpk_writer = lazy_import("vpk_writer")
+    resample = lazy_import("resample")
+except ImportError:
+    vtf_writer = lazy_import(".vtf_writer", __package__)
+    vpk_writer = lazy_import(".vpk_writer", __package__)
+    resample = lazy_import(".resample", __package__)
+
+VTFLib = None # VTFLibWrapper modules, loaded by load_vtflib on the first export
+VTFLibEnums = None
+VTFLIB_LOADED = False
+
+VERSION = "221028"
+DEBUG_MESSAGES = False
+VTF_BACKEND = "auto" # "auto", "vtflib" or "numpy"
+TILE_BUDGET = 0 # Bytes of working memory per tile in tiled mode (the decoded source maps come on top), 0 processes whole images
+MIP_FILTER = "box" # Filter for the mipmaps and the power of two resize, see resample.FILTERS
+MIP_CORRECTION = False # Renormalise normal map mips and keep the alpha coverage of the diffuse mips
+ALPHA_COVERAGE_THRESHOLD = 127 # Alpha value that counts as covered for the diffuse alpha (the metal mask)
+TILE_BYTES_PER_PIXEL = 96 # Rough working memory per pixel of a tile (source crops, temporaries, output rows)
+TEXTURE_STORE = None # Folder of the content addressed texture store while DedupTextures is on, see link_stored
+TEXTURE_STORE_NAME = ".fvm_textures"
+TEMPLATES = None # Compiled VMT templates of the current run or job, loaded on first use after apply_settings, see get_templates
+
+def debug(message, pretty=False):
+    if DEBUG_MESSAGES:
+        if not pretty:
+            print("[FVM]", message)
+        else:
+            pprint.pprint(message)
+
+WARNED = set() # Warnings this process already printed
+
+def warn_once(message): # Print a warning the first time it comes up, once per worker instead of once per texture
+    if message not in WARNED:
+        WARNED.add(message)
+        print("[FVM] [WARNING]", message)
+
+class DirectoryIndex: # One scan of the input folder that maps (material name, map suffix, extension) to the texture's path
+    def __init__(self, path, suffixes, extensions, recursive=False):
+        self.path = path
+        self.extensions = [extension.lower() for extension in extensions] # In order of preference
+        self.files = {}
+        suffixes = set(suffixes)
+        for relative_dir, file_name, file_path in self.scan(path, recursive):
+            stem, dot, extension = file_name.rpartition(".")
+            if not dot or extension.lower() not in self.extensions:
+                continue
+            for suffix in suffixes:
+                if stem.endswith(suffix) and len(stem) > len(suffix):
+                    name = relative_dir + stem[:len(stem)-len(suffix)]
+                    self.files[(name, suffix, extension.lower())] = file_path
+
+    @staticmethod
+    def scan(path, recursive, relative_dir=""): # Yields (relative folder, file name, path) for every file, the folder uses "/" and ends with one
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield relative_dir, entry.name, os.path.join(path, entry.name)
+                elif recursive and entry.is_dir() and not entry.name.startswith("."):
+                    yield from DirectoryIndex.scan(entry.path, recursive, relative_dir + entry.name + "/")
+
+    def find(self, name, suffix): # Path of a material's map, or None if there is none
+        for extension in self.extensions:
+            path = self.files.get((name, suffix, extension))
+            if path is not None:
+                return path
+        return None
+
+    def material_names(self, suffix): # Every material that has a map with "suffix", sorted so batches always run and report in the same order
+        return sorted({name for (name, file_suffix, _) in self.files if file_suffix == suffix})
+
+def get_directory_index(settings):
+    return DirectoryIndex(settings["input_path"], settings["suffixes"].values(), settings["input_extensions"], settings["recursive_input"])
+
+def find_material_names(index, input_mat_name, input_mat_suffix): # Uses the color map to determine the material names, an empty "input_mat_name" picks up every material
+    names = index.material_names(input_mat_suffix)
+    if input_mat_name:
+        return [name for name in names if name == input_mat_name]
+    return names
+
+def find_texture(index, name, suffix): # Get the full path of a material's texture, raises FileNotFoundError if there is none
+    path = index.find(name, suffix)
+    if path is None:
+        raise FileNotFoundError(f"No '{suffix}' texture ({', '.join(index.extensions)}) found for material '{name}' in '{index.path}'")
+    return path
+
+OUTPUT_SINK = None # Set to a MemoryOutput to collect the outputs instead of writing them, see run_conversion's VPK mode
+CREATED_FOLDERS = set() # Output folders this run already made sure exist
+COPIED_ASSETS = set() # (asset, output folder) pairs this run already copied
+
+def read_umask(): # The process' umask from /proc, None where there is none
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    return None
+
+UMASK = read_umask()
+if UMASK is None: # os.umask can only read it by setting it, which threads would see for a moment, so only once while importing
+    UMASK = os.umask(0)
+    os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK # Mode of newly created files, see get_file_mode
+
+def reset_output_cache(): # Forget which folders exist and which assets were copied, called at the start of every run
+    CREATED_FOLDERS.clear()
+    COPIED_ASSETS.clear()
+
+def make_folder(path): # mkdir -p, but only the first time a folder is seen, every check is a round trip on network drives
+    path = os.path.abspath(path)
+    if path not in CREATED_FOLDERS:
+        os.makedirs(path, exist_ok=True)
+        CREATED_FOLDERS.add(path)
+
+def get_file_mode(path=None): # Mode of the file at "path", or the one a new file gets (0o666 minus the umask) if there is none
+    if path is not None:
+        try:
+            return os.stat(path).st_mode & 0o7777
+        except OSError:
+            pass
+    return FILE_MODE
+
+def make_temp_file(folder, path=None): # Unique temporary file in "folder" with the mode of "path", mkstemp alone would leave it readable by its owner only
+    make_folder(folder)
+    try:
+        fd, temp_path = tempfile.mkstemp(prefix=".fvm_", suffix=".tmp", dir=folder)
+    except FileNotFoundError: # Deleted since make_folder saw it, e.g. between two runs of a watch session or a job server worker
+        CREATED_FOLDERS.discard(os.path.abspath(folder))
+        make_folder(folder)
+        fd, temp_path = tempfile.mkstemp(prefix=".fvm_", suffix=".tmp", dir=folder)
+    os.close(fd)
+    os.chmod(temp_path, get_file_mode(path))
+    return temp_path
+
+@contextmanager
+def atomic_output(path): # Yields a temporary path next to "path" to write the file to, which then replaces "path" in one step
+    if OUTPUT_SINK is not None: # The file only needs to exist until its bytes are handed to the sink
+        fd, temp_path = tempfile.mkstemp(prefix=".fvm_", suffix=".tmp")
+        os.close(fd)
+        try:
+            yield temp_path
+            with open(temp_path, 'rb') as f:
+                OUTPUT_SINK.write(path, f.read())
+        finally:
+            os.remove(temp_path)
+        return
+    temp_path = make_temp_file(os.path.dirname(path) or ".", path) # Unique name, so parallel workers never write to the same file, materials from subfolders of the input keep their subfolder
+    try:
+        yield temp_path
+        os.replace(temp_path, path) # Readers see either the old or the new file, never half of one
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_output(path, data): # Write bytes or text to "path" atomically
+    if OUTPUT_SINK is not None:
+        OUTPUT_SINK.write(path, data.encode() if isinstance(data, str) else data)
+        return
+    with atomic_output(path) as temp_path:
+        with open(temp_path, 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+
+def copy_shared_asset(source, output_path): # Copy a file every material of a folder references, once per folder and only if it changed
+    destination = os.path.join(output_path, os.path.basename(source))
+    if OUTPUT_SINK is not None: # Only the source path, the parent reads it once per archive
+        OUTPUT_SINK.assets[destination] = source
+        return
+    key = (source, os.path.abspath(output_path))
+    if key in COPIED_ASSETS:
+        return
+    stat = os.stat(source)
+    try:
+        old = os.stat(destination)
+        unchanged = old.st_size == stat.st_size and old.st_mtime_ns == stat.st_mtime_ns
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        with atomic_output(destination) as temp_path:
+            shutil.copy2(source, temp_path) # Keeps the modification time for the check above
+    COPIED_ASSETS.add(key)
+
+class MemoryOutput: # Output sink that keeps the generated files in memory, worker processes hand them to the parent
+    def __init__(self):
+        self.files = {}
+        self.assets = {} # Destination -> path of a shared file, see copy_shared_asset
+
+    def write(self, path, data):
+        self.files[path] = data
+
+def get_archive_path(path): # Path of an output inside a VPK, from its "materials" folder on like get_kv_output_path
+    folders = pathlib.Path(path).parts
+    try:
+        mat_index = folders.index("materials")
+    except ValueError:
+        raise ValueError("Output path should contain a materials folder")
+    return "/".join(folders[mat_index:])
+
+CHUNK_PIXELS = 1 << 18 # Pixels processed per step by the packing functions, keeps the wider temporary arrays small
+EXPONENT_GREEN = 127 # What blending the green channel with (0, 217, 0) and converting it to "L" used to produce
+
+def row_slices(height, rows):
+    for start in range(0, height, rows):
+        yield slice(start, min(start + rows, height))
+
+def get_tile_rows(width): # Rows per tile that fit into TILE_BUDGET, a multiple of 4 so tiles line up with DXT blocks
+    return max(4, TILE_BUDGET // (width * TILE_BYTES_PER_PIXEL) // 4 * 4)
+
+def get_luminance(rgb): # (h, w, 3) uint8 to (h, w) luminance, the same fixed point math as PIL's convert("L")
+    rgb = rgb.astype(np.uint32)
+    return ((rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+def blend_arrays(a, b, alpha): # Same as Image.blend: float math, truncated and clipped to 0-255
+    a = a.astype(np.float32)
+    result = a + np.float32(alpha) * (b.astype(np.float32) - a)
+    return np.clip(result, 0, 255).astype(np.uint8)
+
+def pack_diffuse(color, ao, gloss, metal, metallic_factor, out=None): # Fused diffuse pass: color/ao/gloss are (h, w, 3) RGB, metal is (h, w) L, ao can be None
+    height, width = color.shape[:2]
+    if out is None:
+        out = np.empty((height, width, 4), dtype=np.uint8)
+    for rows in row_slices(height, max(1, CHUNK_PIXELS // width)):
+        color_rows = color[rows].astype(np.uint32)
+        if ao is not None: # Combine diffuse and occlusion map, like ImageChops.multiply
+            out[rows, :, :3] = color_rows * ao[rows] // 255
+        else: # Combine diffuse and glossiness map
+            out[rows, :, :3] = blend_arrays(color_rows, color_rows * gloss[rows] // 255, 0.3)
+        out[rows, :, 3] = blend_arrays(get_luminance(color[rows]), metal[rows], metallic_factor) # Blend the alpha channel with the metal map
+    return out
+
+def pack_exponent(gloss, clear_exponent, out=None): # Fused exponent pass: gloss is (h, w, 4) RGBA, red and alpha are kept
+    if out is None:
+        out = np.empty(gloss.shape[:2] + (4,), dtype=np.uint8)
+    out[..., 0] = gloss[..., 0]
+    out[..., 1] = 255 if clear_exponent else EXPONENT_GREEN
+    out[..., 2] = 0
+    out[..., 3] = gloss[..., 3]
+    return out
+
+MIP_MODES = {"diffuse": "coverage", "normal": "normal"} # Which mipmap correction each generated texture gets
+
+def get_texture_formats(force_compression): # VTF format of every generated texture
+    return {
+        "diffuse": 'DXT5',
+        "exponent": 'DXT5' if force_compression else 'DXT1',
+        "normal": 'DXT5' if force_compression else 'RGBA8888',
+    }
+
+def diffuse_tiles(bundle, metallic_factor): # make_tile(rows) function that generates rows of the diffuse map
+    def make_tile(rows):
+        color = bundle.get_tile("color", "RGB", rows)
+        metal = bundle.get_tile("metal", "L", rows)
+        if bundle.has("ao"):
+            return pack_diffuse(color, bundle.get_tile("ao", "RGB", rows), None, metal, metallic_factor)
+        return pack_diffuse(color, None, bundle.get_tile("gloss", "RGB", rows), metal, metallic_factor)
+    return make_tile
+
+def exponent_tiles(bundle, clear_exponent):
+    def make_tile(rows):
+        return pack_exponent(bundle.get_tile("gloss", "RGBA", rows), clear_exponent)
+    return make_tile
+
+def normal_tiles(bundle, midtone, gamma_all_pixels=False):
+    def make_tile(rows):
+        finalNormal = np.array(bundle.get_tile("normal", "RGBA", rows)) # Copy, cached arrays are read-only
+        finalGloss = apply_gamma(bundle.get_tile("gloss", "RGB", rows), int(midtone), gamma_all_pixels, rows.start)
+        finalNormal[..., 3] = get_luminance(finalGloss) # The adjusted gloss map goes into the alpha channel
+        return finalNormal
+    return make_tile
+
+def do_diffuse(bundle, metallic_factor, name, output_path): # Generate Diffuse/Color map
+    export_texture_tiles(bundle.size, diffuse_tiles(bundle, metallic_factor), os.path.join(output_path, name+'_c.vtf'), get_texture_formats(False)["diffuse"], MIP_MODES["diffuse"])
+    debug("Diffuse exported")
+
+def do_exponent(bundle, clear_exponent, force_compression, name, output_path): # Generate the exponent map
+    export_texture_tiles(bundle.size, exponent_tiles(bundle, clear_exponent), os.path.join(output_path, name+'_m.vtf'), get_texture_formats(force_compression)["exponent"])
+    debug("Exponent exported")
+
+def do_normal(midtone, bundle, force_compression, export_images, name, output_path, gamma_all_pixels=False):
+    make_tile = normal_tiles(bundle, midtone, gamma_all_pixels)
+    image_format = get_texture_formats(force_compression)["normal"]
+    if export_images: # The TGA needs the whole image anyway
+        finalNormal = make_tile(slice(0, bundle.size[1]))
+        Image.fromarray(finalNormal, 'RGBA').save((name+'_n.tga'), 'TGA')
+        export_texture(finalNormal, os.path.join(output_path, name+'_n.vtf'), image_format, MIP_MODES["normal"])
+    else:
+        export_texture_tiles(bundle.size, make_tile, os.path.join(output_path, name+'_n.vtf'), image_format, MIP_MODES["normal"]) # Export normal map as *_n.vtf
+    debug("Normal exported")
+
+def get_gamma_correction(mt): # Convert the midtone "mt" (0-255) into the exponent used for the gamma adjustment, similar to how photoshop does it
+    gamma = 1
+    midToneNormal = mt / 255
+    if mt < 128:
+        midToneNormal = midToneNormal * 2
+        gamma = 1 + (9*(1-midToneNormal))
+        gamma = min(gamma, 9.99)
+    elif mt > 128:
+        midToneNormal = (midToneNormal * 2) - 1
+        gamma = 1 - midToneNormal
+        gamma = max(gamma, 0.01)
+    return 1/gamma
+
+def make_gamma_lut(mt): # Precompute the gamma adjustment for every possible 8-bit channel value
+    if mt == 128:
+        return np.arange(256, dtype=np.uint8)
+    gamma_correction = get_gamma_correction(mt)
+    # * Uses the exact same float math as the old per-pixel do_gamma (see tests/test_packing.py) so the output stays byte-identical
+    return np.array([math.ceil(255 * pow(v / 255, gamma_correction)) for v in range(256)], dtype=np.uint8)
+
+def apply_gamma(im_data, mt, all_pixels=False, first_row=0): # Gamma adjustment of a (height, width, 3 or 4) array starting at row "first_row" of the image, alpha is left untouched
+    lut = make_gamma_lut(mt)
+    result = np.array(im_data, dtype=np.uint8, copy=True)
+    if all_pixels:
+        result[..., :3] = lut[result[..., :3]]
+    else: # The old per-pixel loop started at 1, so the first row and column never got adjusted
+        skip_rows = 1 if first_row == 0 else 0
+        result[skip_rows:, 1:, :3] = lut[result[skip_rows:, 1:, :3]]
+    return result
+
+def fix_scale_mismatch(rgbIm, target): # Resize the target image to be the same as rgbIm (needed for normal maps)
+    factor = rgbIm.height / target.height
+    fixedMap = ImageOps.scale(target, factor)
+    return fixedMap
+
+def get_scaled_size(rgbIm, target): # Size fix_scale_mismatch resizes "target" to
+    factor = rgbIm.height / target.height
+    return (round(factor * target.width), round(factor * target.height)) if factor != 1 else target.size
+
+SCALE_SUPPORT = 2 # Radius of the bicubic filter fix_scale_mismatch uses, in pixels of the smaller image
+
+def get_kv_output_path(output_path):
+    folders = pathlib.Path(output_path).parts
+    try:
+        mat_index = folders.index("materials")
+    except ValueError:
+        raise ValueError("Output path should contain a materials folder")
+    return "/".join(folders[mat_index+1:]) + "/"
+
+def get_material_path(mName, settings): # Where the VMT of a material goes, normalized materials get an "_s" suffix
+    return os.path.join(settings["output_path"], mName + ("_s.vmt" if settings["clear_exponent"] else ".vmt"))
+
+def get_templates(settings): # The template folder is checked once per run or job, not for every material
+    global TEMPLATES
+    if TEMPLATES is None:
+        TEMPLATES = vmt_templates.load_templates(settings["template_path"])
+    return TEMPLATES
+
+def get_material_text(mName, settings): # Contents of the VMT of a material, rendered from its template
+    return vmt_templates.render_material(mName, settings, get_kv_output_path(settings["output_path"]), VERSION, get_templates(settings))
+
+def do_material(mName, settings, batch=None): # Create the material, or add it to "batch" (a MemoryOutput) to be written together with the others
+    debug("Creating material '"+ mName + "'")
+    path = get_material_path(mName, settings)
+    text = get_material_text(mName, settings)
+    phongwarp = os.path.join(os.path.dirname(__file__), "phongwarp_steel.vtf") if vmt_templates.uses_phongwarp(settings, get_templates(settings)) else None
+    if batch is not None:
+        batch.write(path, text.encode())
+        if phongwarp:
+            batch.assets[os.path.join(settings["output_path"], os.path.basename(phongwarp))] = phongwarp
+        return
+    write_output(path, text)
+    if phongwarp:
+        copy_shared_asset(phongwarp, settings["output_path"])
+    debug("Material exported")
+
+def write_batch(batch): # Write the files of a MemoryOutput in one pass, sorted so every folder is handled in one go
+    for path in sorted(batch.files):
+        write_output(path, batch.files[path])
+    for destination, source in sorted(batch.assets.items()):
+        copy_shared_asset(source, os.path.dirname(destination))
+
+def load_vtflib(): # Import VTFLibWrapper once, VTFLib stays None if it can't be loaded
+    global VTFLib, VTFLibEnums, VTFLIB_LOADED
+    if VTFLIB_LOADED:
+        return VTFLib
+    VTFLIB_LOADED = True
+    try:  # The user might have their own up-to-date version
+        import VTFLibWrapper.VTFLib as vtflib_module
+        import VTFLibWrapper.VTFLibEnums as enums_module
+    except (ImportError, OSError):  # Use the bundled one
+        try:
+            from .VTFLibWrapper import VTFLib as vtflib_module, VTFLibEnums as enums_module
+        except (ImportError, OSError):  # No usable VTFLib, only the built-in encoder is available
+            return None
+    VTFLib, VTFLibEnums = vtflib_module, enums_module
+    return VTFLib
+
+def get_vtf_backend(): # Resolve the configured VTF_BACKEND into the one that's actually used
+    if VTF_BACKEND != "numpy":
+        load_vtflib()
+    if VTF_BACKEND == "auto":
+        return "vtflib" if VTFLib is not None else "numpy"
+    if VTF_BACKEND == "vtflib" and VTFLib is None:
+        raise RuntimeError("VTFBackend is set to 'vtflib', but VTFLibWrapper could not be loaded")
+    if VTF_BACKEND not in ("vtflib", "numpy"):
+        raise ValueError(f"Unknown VTF backend '{VTF_BACKEND}', use 'auto', 'vtflib' or 'numpy'")
+    return VTF_BACKEND
+
+VTF_LIB = None # VTFLib instance, created on first use and kept so the library only gets initialised once per process
+
+def get_vtflib():
+    global VTF_LIB
+    if VTF_LIB is None:
+        VTF_LIB = VTFLib.VTFLib()
+    return VTF_LIB
+
+def save_vtflib(image_data, path, imageFormat=None): # Encode an RGBA array with VTFLib and save it to "path"
+    from ctypes import create_string_buffer # Only needed for VTFLib, not worth importing on every run
+    if MIP_FILTER != "box" or MIP_CORRECTION: # VTFLib makes its own mipmaps from the full size image
+        warn_once("VTFLib makes its own mipmaps, so MipmapFilter only applies to the power of two resize and MipmapCorrection is ignored, set VTFBackend to \"numpy\" to use them")
+    imageFormat = imageFormat or 'RGBA8888'
+    vtf_lib = get_vtflib()
+    def_options = vtf_lib.create_default_params_structure()
+    if imageFormat.startswith('RGBA8888'):
+        def_options.ImageFormat = VTFLibEnums.ImageFormat.ImageFormatRGBA8888
+        def_options.Flags |= VTFLibEnums.ImageFlag.ImageFlagEightBitAlpha
+        if imageFormat == 'RGBA8888Normal':
+            def_options.Flags |= VTFLibEnums.ImageFlag.ImageFlagNormal
+    elif imageFormat.startswith('DXT1'):
+        def_options.ImageFormat = VTFLibEnums.ImageFormat.ImageFormatDXT1
+        if imageFormat == 'DXT1Normal':
+            def_options.Flags |= VTFLibEnums.ImageFlag.ImageFlagNormal
+    elif imageFormat.startswith('DXT5'):
+        def_options.ImageFormat = VTFLibEnums.ImageFormat.ImageFormatDXT5
+        def_options.Flags |= VTFLibEnums.ImageFlag.ImageFlagEightBitAlpha
+        if imageFormat == 'DXT5Normal':
+            def_options.Flags |= VTFLibEnums.ImageFlag.ImageFlagNormal
+    else:
+        def_options.ImageFormat = VTFLibEnums.ImageFormat.ImageFormatRGBA8888
+        def_options.Flags |= VTFLibEnums.ImageFlag.ImageFlagEightBitAlpha
+
+
+    def_options.Resize = 1
+    h, w = image_data.shape[:2]
+    image_data = create_string_buffer(image_data.tobytes())
+    vtf_lib.image_create_single(w, h, image_data, def_options)
+    vtf_lib.image_save(path)
+    vtf_lib.image_destroy()
+
+def prepare_texture(texture): # RGBA array resized to the nearest power of two, so VTFLib's own resize never runs
+    image_data = vtf_writer.to_rgba(np.asarray(texture, dtype=np.uint8))
+    return resample.resize_power_of_two(image_data, "triangle" if MIP_FILTER == "box" else MIP_FILTER) # A box filter only suits halving
+
+def get_mipmaps(image_data, mip_mode=None): # Mip chain of a prepared texture, "mip_mode" is "normal" or "coverage" for the corrections of MIP_CORRECTION
+    return resample.generate_mipmaps(image_data, MIP_FILTER, normal_map=MIP_CORRECTION and mip_mode == "normal",
+                                     alpha_threshold=ALPHA_COVERAGE_THRESHOLD if MIP_CORRECTION and mip_mode == "coverage" else None)
+
+def encode_texture(texture, imageFormat=None, mip_mode=None): # Encode an image or RGBA array into the bytes of a VTF file
+    image_data = prepare_texture(texture)
+    if get_vtf_backend() == "numpy":
+        vtf_format, flags = vtf_writer.parse_format(imageFormat)
+        return vtf_writer.write_vtf(image_data, vtf_format, flags, mipmaps=get_mipmaps(image_data, mip_mode))
+    with tempfile.TemporaryDirectory(prefix=".fvm_") as work_dir: # VTFLib can only save to a file
+        path = os.path.join(work_dir, "texture.vtf")
+        save_vtflib(image_data, path, imageFormat)
+        with open(path, 'rb') as f:
+            return f.read()
+
+def get_texture_hasher(width, height, imageFormat=None, mip_mode=None): # Hash object for the RGBA pixels of a texture, seeded with everything else that changes the encoded file
+    texture_hash = hashlib.blake2b(digest_size=16)
+    backend = get_vtf_backend()
+    mip_correction = MIP_CORRECTION and backend == "numpy" # VTFLib ignores it, see save_vtflib
+    texture_hash.update(repr((VERSION, backend, MIP_FILTER, mip_correction, imageFormat, mip_mode, width, height)).encode())
+    return texture_hash
+
+def get_texture_key(texture, imageFormat=None, mip_mode=None): # Content address of a texture, the same for every texture that would encode to the same file
+    image_data = vtf_writer.to_rgba(texture)
+    texture_hash = get_texture_hasher(image_data.shape[1], image_data.shape[0], imageFormat, mip_mode)
+    texture_hash.update(np.ascontiguousarray(image_data))
+    return texture_hash.hexdigest()
+
+def get_texture_store(settings): # Folder of the texture store: TextureStorePath, or ".fvm_textures" next to the "materials" folder of the output path
+    # Never inside the materials tree, copying or packing that would ship a second copy of every texture
+    if settings["texture_store_path"]:
+        return settings["texture_store_path"]
+    folders = os.path.abspath(settings["output_path"]).split(os.sep)
+    if "materials" in folders:
+        return os.path.join(os.sep.join(folders[:folders.index("materials")]) + os.sep, TEXTURE_STORE_NAME)
+    return os.path.join(os.path.dirname(os.path.abspath(settings["output_path"])), TEXTURE_STORE_NAME)
+
+def get_stored_path(key):
+    return os.path.join(TEXTURE_STORE, key + ".vtf")
+
+def link_stored(key, path): # Make "path" a hard link to the stored texture "key" (a copy if hard links aren't supported), False if it isn't stored
+    stored = get_stored_path(key)
+    if not os.path.exists(stored):
+        return False
+    if os.path.exists(path) and os.path.samefile(stored, path):
+        return True
+    try:
+        with atomic_output(path) as temp_path:
+            os.remove(temp_path) # Only the unique name is needed
+            try:
+                os.link(stored, temp_path)
+            except FileNotFoundError:
+                raise
+            except OSError: # FAT drives and some network shares
+                shutil.copyfile(stored, temp_path)
+    except FileNotFoundError: # Another run on the same output folder cleaned it up since the check above
+        return False
+    debug("Reused the identical texture '" + key + "' for '" + path + "'")
+    return True
+
+@contextmanager
+def texture_output(path, key=None): # atomic_output for a texture, with a key the file is written into the texture store and "path" links to it
+    if key is None:
+        with atomic_output(path) as temp_path:
+            yield temp_path
+        return
+    stored = get_stored_path(key)
+    temp_path = make_temp_file(TEXTURE_STORE)
+    try:
+        yield temp_path
+        try:
+            os.link(temp_path, stored) # Unlike os.replace, this keeps a texture another worker stored in the meantime, outputs may link to it already
+        except FileExistsError:
+            pass
+        except OSError: # No hard links, "path" gets a copy of its own and the store keeps one for the next duplicates
+            with atomic_output(path) as output_temp:
+                shutil.copyfile(temp_path, output_temp)
+            os.replace(temp_path, stored)
+            return
+        # Linked while the temporary file still holds the texture, so clean_texture_store of another run can't remove it in between
+        if not link_stored(key, path): # Only a texture another worker stored can be gone already
+            raise RuntimeError(f"'{path}' wasn't written, the stored texture '{key}' was removed by another run on the same output folder")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def clean_texture_store(store): # Delete stored textures that no output links to anymore, and the store itself once it's empty, returns how many
+    if not os.path.isdir(store):
+        return 0
+    removed = 0
+    with os.scandir(store) as entries:
+        for entry in entries:
+            if entry.name.endswith(".vtf") and entry.stat().st_nlink < 2:
+                os.remove(entry.path)
+                removed += 1
+    if not os.listdir(store): # DedupTextures was turned off and every output is a file of its own again
+        os.rmdir(store)
+    return removed
+
+def export_texture(texture, path, imageFormat=None, mip_mode=None): # Exports an image or RGBA array to VTF using VTFLib or the built-in encoder, the file is written once and atomically
+    key = get_texture_key(texture, imageFormat, mip_mode) if TEXTURE_STORE else None
+    if key and link_stored(key, path): # Another material already produced exactly this texture
+        return
+    if get_vtf_backend() == "numpy":
+        if key:
+            with texture_output(path, key) as temp_path:
+                with open(temp_path, 'wb') as f:
+                    f.write(encode_texture(texture, imageFormat, mip_mode))
+        else:
+            write_output(path, encode_texture(texture, imageFormat, mip_mode))
+        return
+    with texture_output(path, key) as temp_path: # VTFLib makes its own mipmaps
+        save_vtflib(prepare_texture(texture), temp_path, imageFormat)
+
+def get_untiled_reasons(width, height, mip_mode=None): # Why a texture can't be streamed into the encoder tile by tile, empty if it can
+    reasons = []
+    if get_vtf_backend() != "numpy":
+        reasons.append("the VTFLib backend")
+    if not (vtf_writer.is_power_of_two(width) and vtf_writer.is_power_of_two(height)):
+        reasons.append(f"sizes that aren't a power of two ({width}x{height})")
+    if MIP_FILTER != "box":
+        reasons.append(f"the '{MIP_FILTER}' mipmap filter")
+    if MIP_CORRECTION and mip_mode:
+        reasons.append("MipmapCorrection")
+    return reasons
+
+def export_texture_tiles(size, make_tile, path, imageFormat=None, mip_mode=None): # Exports a texture that make_tile(rows) generates, streaming it tile by tile into the encoder if TILE_BUDGET is set
+    width, height = size
+    if not TILE_BUDGET:
+        export_texture(make_tile(slice(0, height)), path, imageFormat, mip_mode)
+        return
+    tiles = row_slices(height, get_tile_rows(width))
+    reasons = get_untiled_reasons(width, height, mip_mode)
+    if reasons: # The tiles still avoid full size temporaries, but the whole texture gets assembled and encoded at once
+        warn_once(f"TileBudgetMB can't stream textures with {', '.join(reasons)}, they are encoded as whole images and use more memory than the budget")
+        image_data = np.empty((height, width, 4), dtype=np.uint8)
+        for rows in tiles:
+            image_data[rows] = make_tile(rows)
+        export_texture(image_data, path, imageFormat, mip_mode)
+        return
+    vtf_format, flags = vtf_writer.parse_format(imageFormat)
+    writer = vtf_writer.VTFStreamWriter(width, height, vtf_format, flags, spool_size=TILE_BUDGET)
+    texture_hash = get_texture_hasher(width, height, imageFormat, mip_mode) if TEXTURE_STORE else None
+    for rows in tiles:
+        tile = vtf_writer.to_rgba(make_tile(rows))
+        if texture_hash:
+            texture_hash.update(np.ascontiguousarray(tile))
+        writer.write_rows(tile)
+    key = texture_hash.hexdigest() if texture_hash else None
+    if key and link_stored(key, path): # The key is only known once every tile went through the encoder, but the file is still shared
+        return
+    with texture_output(path, key) as temp_path:
+        with open(temp_path, 'wb') as f:
+            writer.save(f)
+
+def get_config(config_path):
+    parser = configparser.ConfigParser()
+    parser.read(config_path)
+    return parser
+
+def get_default_config():
+    this_dir = os.path.dirname(__file__)
+    return get_config(os.path.join(this_dir, "config.ini"))
+
+def get_settings(config): # Parse the config into plain values that can be handed to worker processes
+    return {
+        "debug_messages": eval(config["Debug"]["DebugMessages"]),
+        "input_extensions": [extension.strip().lstrip(".") for extension in config["Paths"]["InputFileExtension"].split(",") if extension.strip()],
+        "input_path": config["Paths"]["InputPath"],
+        "recursive_input": eval(config["Paths"].get("RecursiveInput", "False")),
+        "mat_name": config["Paths"]["MaterialName"],
+        "output_path": config["Paths"]["OutputPath"],
+        "midtone": config["ImageConfig"]["GammaAdjustment"],
+        "gamma_all_pixels": eval(config["ImageConfig"].get("GammaAllPixels", "False")),
+        "export_images": eval(config["ImageConfig"]["ExportTGA"]),
+        "material_setup": config["ImageConfig"]["RoughOrGloss"],
+        "force_compression": eval(config["ImageConfig"]["UseCompression"]),
+        "clear_exponent": eval(config["ImageConfig"]["EmptyGreenOnExponentMap"]),
+        "metallic_factor": eval(config["ImageConfig"]["Metalness"])/255*0.83, # ? Weird ass conversion to account for the lambert factor
+        "material_proxies": eval(config["ImageConfig"]["UseMaterialProxies"]),
+        "orm": eval(config["ImageConfig"]["ORMTextureMode"]),
+        "phongwarps": eval(config["ImageConfig"]["UsePhongwarps"]),
+        "material_template": config["ImageConfig"].get("MaterialTemplate", "").strip(),
+        "template_path": config["Paths"].get("TemplatePath", "").strip(),
+        "dedup_textures": eval(config["ImageConfig"].get("DedupTextures", "False")),
+        "texture_store_path": config["Paths"].get("TextureStorePath", "").strip(),
+        "vtf_backend": config["ImageConfig"].get("VTFBackend", "auto"),
+        "tile_budget": int(float(config["ImageConfig"].get("TileBudgetMB", "0")) * (1 << 20)),
+        "mip_filter": config["ImageConfig"].get("MipmapFilter", "box").strip().lower(),
+        "mip_correction": eval(config["ImageConfig"].get("MipmapCorrection", "False")),
+        "vpk_path": config["Paths"].get("VPKOutput", ""),
+        "vpk_chunk_size": int(float(config["Paths"].get("VPKChunkMB", "0")) * (1 << 20)),
+        "print_config": eval(config["Debug"]["PrintConfig"]),
+        "suffixes": dict(config["ImageSuffixes"]),
+    }
+
+def find_material_textures(name, settings, index): # Get the paths of all source maps of a material, maps without a suffix in the config are None
+    suffixes = settings["suffixes"]
+    if settings["orm"]:
+        return {
+            "color": find_texture(index, name, suffixes["color"]),
+            "normal": find_texture(index, name, suffixes["normal"]),
+            "orm": find_texture(index, name, suffixes["roughness"]),
+        }
+    textures = {}
+    for role in ("color", "ao", "normal", "roughness", "metal"):
+        if role == "color" or suffixes[role]: # If a map is set
+            textures[role] = find_texture(index, name, suffixes[role])
+        else:
+            textures[role] = None
+    return textures
+
+def get_output_files(name, settings): # The files convert_material generates for a material
+    output_path = settings["output_path"]
+    return {
+        "diffuse": os.path.join(output_path, name + "_c.vtf"),
+        "exponent": os.path.join(output_path, name + "_m.vtf"),
+        "normal": os.path.join(output_path, name + "_n.vtf"),
+        "material": get_material_path(name, settings),
+    }
+
+class TextureBundle: # The source maps of a material, decoded, resized and normalised once and shared by all generators
+    def __init__(self, textures, settings):
+        self.images = {}
+        self.arrays = {}
+        self.tiled = TILE_BUDGET > 0 # Tiles are cropped, inverted, scaled and converted on demand instead of keeping full size copies
+        self.inverted = {} # Role -> mode a map gets inverted in, applied per tile in tiled mode
+        self.scaled = {} # Role -> size a map gets scaled to, applied per tile in tiled mode
+        if settings["orm"]:
+            self.load_orm(textures)
+        else:
+            self.load_separate(textures, settings["material_setup"])
+        normalImage = self.images["normal"]
+        for role, image in self.images.items(): # Everything gets scaled to the normal map (needed for the alpha channels)
+            if image is not None and image.size != normalImage.size:
+                self.scaled[role] = get_scaled_size(normalImage, image)
+        if not self.tiled:
+            for role, mode in self.inverted.items():
+                self.images[role] = ImageOps.invert(self.images[role].convert(mode))
+            for role in self.scaled:
+                self.images[role] = fix_scale_mismatch(normalImage, self.images[role])
+            self.inverted, self.scaled = {}, {}
+        self.size = normalImage.size
+
+    def load_separate(self, textures, material_setup):
+        colorImage = Image.open(textures["color"])
+        self.images["color"] = colorImage
+        self.images["ao"] = Image.open(textures["ao"]) if textures["ao"] else None # Without an AO map the gloss map gets blended into the diffuse instead
+        if textures["normal"]:
+            self.images["normal"] = Image.open(textures["normal"])
+        else:
+            self.images["normal"] = Image.new('RGB', colorImage.size, (128,128,255)) # If no Normal image is given, use a flat one
+        if textures["metal"]:
+            self.images["metal"] = Image.open(textures["metal"])
+        else:
+            self.images["metal"] = Image.new('L', colorImage.size, 0) # If no Metalness image is given, use a black image
+        if textures["roughness"]:
+            glossImage = Image.open(textures["roughness"])
+        else:
+            glossImage = Image.new('RGB', colorImage.size, (255,255,255)) # If no Gloss image is given, use a white image
+        if material_setup == "rough":
+            self.inverted["gloss"] = 'RGB'
+        self.images["gloss"] = glossImage
+
+    def load_orm(self, textures):
+        self.images["color"] = Image.open(textures["color"])
+        self.images["normal"] = Image.open(textures["normal"])
+        try:
+            (r,g,b) = Image.open(textures["orm"]).convert('RGB').split() # The ORM map is only decoded once for all three channels
+        except Exception:
+            raise ValueError("Could not convert color bands on ORM! (Do you have empty image channels?)")
+        self.images["ao"] = r
+        self.images["gloss"] = g
+        self.inverted["gloss"] = 'L'
+        self.images["metal"] = b
+
+    def has(self, role):
+        return self.images.get(role) is not None
+
+    def get(self, role, mode): # Read-only array of a map in the given PIL mode, converted on first use and cached afterwards
+        if self.tiled: # Not cached, the whole point of tiles is to never hold full size arrays
+            return self.get_tile(role, mode, slice(0, self.size[1]))
+        key = (role, mode)
+        if key not in self.arrays:
+            image = self.images[role]
+            self.arrays[key] = np.asarray(image if image.mode == mode else image.convert(mode))
+        return self.arrays[key]
+
+    def get_tile(self, role, mode, rows): # Array of the rows "rows" (a slice) of a map in the given PIL mode
+        if not self.tiled:
+            return self.get(role, mode)[rows]
+        if role in self.scaled:
+            image = self.scale_band(role, rows)
+        else:
+            image = self.invert_band(role, self.images[role].crop((0, rows.start, self.size[0], rows.stop)))
+        return np.asarray(image if image.mode == mode else image.convert(mode))
+
+    def invert_band(self, role, image):
+        return ImageOps.invert(image.convert(self.inverted[role])) if role in self.inverted else image
+
+    def scale_band(self, role, rows): # The rows "rows" of fix_scale_mismatch's result, from only the source rows the filter reaches
+        image = self.images[role]
+        width, height = self.scaled[role]
+        scale = image.height / height # Source rows per output row
+        margin = SCALE_SUPPORT * max(scale, 1) + 1 # A little more than the filter reaches, so the band's edges don't change the result
+        top = max(0, int(rows.start * scale - margin))
+        bottom = min(image.height, math.ceil(rows.stop * scale + margin))
+        band = self.invert_band(role, image.crop((0, top, image.width, bottom)))
+        return band.resize((width, rows.stop - rows.start), Image.BICUBIC, box=(0, rows.start * scale - top, image.width, rows.stop * scale - top))
+
+def convert_material(name, settings, outputs=None, textures=None, batch=None): # Generate the textures and the material for a single material, "outputs" limits which of get_output_files are written
+    # The material goes into "batch" (a MemoryOutput) instead of being written if one is given, see write_batch
+    output_path = settings["output_path"]
+    if outputs is None:
+        outputs = set(get_output_files(name, settings))
+    if textures is None:
+        textures = find_material_textures(name, settings, get_directory_index(settings))
+    debug("Loading:")
+    debug("Material:\t"+ name)
+
+    if not settings["orm"]:
+        print("Color:\t\t" +textures["color"])
+        print("Occlusion:\t" +(textures["ao"] or "None given, ignoring!"))
+        print("Normal:\t\t" +(textures["normal"] or "None given, ignoring!"))
+        print("Metalness:\t" +(textures["metal"] or "None given, ignoring!"))
+        print("Glossiness:\t" +(textures["roughness"] or "None given, ignoring!") + "\n")
+    else:
+        print("Color:\t\t" +textures["color"])
+        print("ORM:\t\t" +textures["orm"])
+        print("Normal:\t\t" +textures["normal"] + "\n")
+
+    output_files = get_output_files(name, settings)
+    if outputs & {"diffuse", "exponent", "normal"}:
+        with profiler.stage("load", name) as stage:
+            bundle = TextureBundle(textures, settings)
+            stage.add_read(*textures.values())
+    if "diffuse" in outputs:
+        with profiler.stage("diffuse", name) as stage:
+            do_diffuse(bundle, settings["metallic_factor"], name, output_path)
+            stage.add_written(output_files["diffuse"])
+    if "exponent" in outputs:
+        with profiler.stage("exponent", name) as stage:
+            do_exponent(bundle, settings["clear_exponent"], settings["force_compression"], name, output_path)
+            stage.add_written(output_files["exponent"])
+    if "normal" in outputs:
+        with profiler.stage("normal", name) as stage:
+            do_normal(settings["midtone"], bundle, settings["force_compression"], settings["export_images"], name, output_path, settings["gamma_all_pixels"])
+            stage.add_written(output_files["normal"])
+
+    if "material" in outputs:
+        with profiler.stage("material", name) as stage:
+            do_material(name, settings, batch)
+            if batch is None:
+                stage.add_written(output_files["material"])
+
+    print("[FVM] Conversion for material '" + name + "' finished, files saved to '" + output_path + "'\n")
+
+def apply_settings(settings): # Set the module wide options from the settings, worker processes don't share the parent's globals
+    global DEBUG_MESSAGES, VTF_BACKEND, TILE_BUDGET, MIP_FILTER, MIP_CORRECTION, TEXTURE_STORE, TEMPLATES
+    DEBUG_MESSAGES = settings["debug_messages"]
+    VTF_BACKEND = settings["vtf_backend"]
+    TILE_BUDGET = settings["tile_budget"]
+    MIP_FILTER = settings["mip_filter"]
+    MIP_CORRECTION = settings["mip_correction"]
+    TEXTURE_STORE = get_texture_store(settings) if settings["dedup_textures"] and not settings["vpk_path"] else None # Archives share duplicate data themselves
+    TEMPLATES = None # Templates may have been edited since the last run or job of this process
+    profiler.enable(settings.get("profile", False))
+
+def take_output(): # The MemoryOutput of the current job (None when writing files), the next job starts a new one
+    global OUTPUT_SINK
+    output, OUTPUT_SINK = OUTPUT_SINK, None
+    return output
+
+def plan_outputs(name, settings, textures, record): # (outputs to regenerate, new manifest record) of a material
+    with profiler.stage("plan", name):
+        outputs, new_record = build_cache.plan_material(record, settings, textures, get_output_files(name, settings), VERSION, (record or {}).get("inputs"))
+    if not outputs:
+        print("[FVM] Material '" + name + "' is up to date, skipping")
+    return outputs, new_record
+
+def convert_material_job(name, settings, textures, record=None, templates=None): # Worker entry point, returns (error, manifest record, profiler records, MemoryOutput) instead of raising so one broken material doesn't abort the whole batch
+    # "templates" are the ones run_conversion loaded, so the jobs don't check the template folder again
+    global OUTPUT_SINK, TEMPLATES
+    apply_settings(settings)
+    TEMPLATES = templates
+    OUTPUT_SINK = MemoryOutput() if settings["vpk_path"] else None # The parent packs the files into the archive
+    batch = None if settings["vpk_path"] else MemoryOutput() # The parent writes the materials of all jobs in one go
+    try:
+        with profiler.stage("total", name):
+            outputs, new_record = plan_outputs(name, settings, textures, record)
+            if not outputs:
+                return None, new_record, profiler.take_records(), take_output()
+            debug("Regenerating " + ", ".join(sorted(outputs)) + " for '" + name + "'")
+            convert_material(name, settings, outputs, textures, batch)
+    except Exception as e:
+        debug(traceback.format_exc())
+        take_output() # Half a material doesn't go into the archive
+        return f"{type(e).__name__}: {e}", None, profiler.take_records(), None
+    return None, new_record, profiler.take_records(), take_output() or batch
+
+def run_conversion(config, jobs=1, force=False, prune=False, only=None, executor=None): # Convert every material in the input folder, using "jobs" worker processes (0 = one per CPU)
+    # "only" limits the run to some of the materials, "executor" is a process pool to reuse instead of starting a new one
+    settings = get_settings(config)
+    settings["profile"] = bool(profiler.HOOKS) # Workers only record stages if someone in this process listens
+    apply_settings(settings)
+    templates = get_templates(settings) # Loaded once for the whole run and handed to the jobs
+    settings["templates_hash"] = vmt_templates.get_templates_hash(templates) # Part of the manifest key of the materials
+    settings["texture_store"] = TEXTURE_STORE # Part of the manifest key of the textures, which link into it
+    reset_output_cache() # Output folders may have been deleted since the last run of this process
+    vpk = None
+    if settings["vpk_path"]: # Archives are always written as a whole, so every material gets converted and the manifest isn't used
+        vpk = vpk_writer.VPKWriter(settings["vpk_path"], settings["vpk_chunk_size"], settings["dedup_textures"])
+        force = True
+        only = None
+
+    with profiler.stage("discovery"):
+        index = get_directory_index(settings)
+        names = find_material_names(index, settings["mat_name"], settings["suffixes"]["color"]) # For every material in the input folder
+        if only is not None:
+            names = [name for name in names if name in only]
+    if not jobs or jobs < 1:
+        jobs = os.cpu_count() or 1
+
+    results = {}
+    material_textures = {}
+    for name in names:
+        try:
+            material_textures[name] = find_material_textures(name, settings, index)
+        except FileNotFoundError as e:
+            results[name] = (f"{type(e).__name__}: {e}", None, [])
+    profiler.emit(profiler.take_records())
+
+    def collect(name, result): # Pack the files of a finished material right away, so they don't pile up in memory
+        error, record, stages, output = result
+        if vpk is None and output is not None: # Only the material, the textures are already written
+            batch.files.update(output.files)
+            batch.assets.update(output.assets)
+        elif output is not None:
+            for path, data in output.files.items():
+                vpk.add(get_archive_path(path), data)
+            for path, source in output.assets.items():
+                if get_archive_path(path) not in vpk:
+                    with open(source, 'rb') as f:
+                        vpk.add(get_archive_path(path), f.read())
+        results[name] = (error, record, stages)
+
+    batch = MemoryOutput() # Materials of every job, written at the end
+    manifest = build_cache.load_manifest(settings["output_path"]) if vpk is None else {"materials": {}}
+    old_manifest = build_cache.dump_manifest(manifest) # Runs that change nothing don't write it, which saves importing tempfile on every start
+    found = []
+    old_records = []
+    for name, textures in material_textures.items():
+        record = None if force else manifest["materials"].get(name) # Without an old record every output counts as changed
+        if record and build_cache.inputs_unchanged(textures, record.get("inputs")): # Cheap to plan here, so a run with nothing to do never starts a worker
+            outputs, new_record = plan_outputs(name, settings, textures, record)
+            stages = profiler.take_records() # The worker plans stale materials again and records that
+            if not outputs:
+                results[name] = (None, new_record, stages)
+                continue
+        found.append(name)
+        old_records.append(record)
+    if executor is not None and found:
+        for name, result in zip(found, executor.map(convert_material_job, found, [settings] * len(found), [material_textures[name] for name in found], old_records, [templates] * len(found))):
+            collect(name, result)
+    elif jobs > 1 and len(found) > 1:
+        with futures.ProcessPoolExecutor(max_workers=min(jobs, len(found))) as executor:
+            for name, result in zip(found, executor.map(convert_material_job, found, [settings] * len(found), [material_textures[name] for name in found], old_records, [templates] * len(found))):
+                collect(name, result)
+    else:
+        for name, record in zip(found, old_records):
+            collect(name, convert_material_job(name, settings, material_textures[name], record, templates))
+
+    failures = {}
+    for name in names: # Report in material order, no matter which worker finished first
+        error, record, stages = results[name]
+        profiler.emit(stages)
+        if error:
+            failures[name] = error
+            manifest["materials"].pop(name, None) # Make sure the next run retries it
+            continue
+        old_record = manifest["materials"].get(name)
+        if prune and old_record:
+            for path in build_cache.get_stale_files(old_record, record):
+                if os.path.exists(path):
+                    os.remove(path)
+                    debug("Pruned '" + path + "'")
+        manifest["materials"][name] = record
+    if vpk is not None:
+        for path in vpk.close():
+            print("[FVM] Wrote '" + path + "'")
+    else:
+        with profiler.stage("write_materials") as stage:
+            write_batch(batch)
+            stage.add_written(*batch.files)
+        profiler.emit(profiler.take_records())
+        if prune and not settings["mat_name"] and only is None: # When converting some of the materials, the others in the manifest aren't stale
+            for path in build_cache.prune(manifest, names):
+                debug("Pruned '" + path + "'")
+        # Also with DedupTextures off, which leaves the whole store unused, and in the output path, where older versions kept it
+        for store in dict.fromkeys((get_texture_store(settings), os.path.join(settings["output_path"], TEXTURE_STORE_NAME))):
+            removed = clean_texture_store(store) # After pruning, which can leave stored textures unused
+            if removed:
+                debug(f"Removed {removed} unused textures from '{store}'")
+        new_manifest = build_cache.dump_manifest(manifest)
+        if new_manifest != old_manifest:
+            write_output(build_cache.get_manifest_path(settings["output_path"]), new_manifest)
+
+    for name, error in failures.items():
+        print(f"[FVM] [ERROR] Conversion for material '{name}' failed: {error}")
+
+    if failures:
+        debug(f"v{VERSION} finished with exit code -1: {len(failures)} of {len(names)} conversions failed.")
+    else:
+        debug(f"v{VERSION} finished with exit code 0: All conversions finished.")
+    if settings["print_config"]:
+        debug("Config file dump:")
+        debug(config, pretty=True)
+    return failures
+
+def snapshot_inputs(settings): # Size and modification time of every source map, keyed by (material name, path)
+    index = get_directory_index(settings)
+    snapshot = {}
+    for (name, _, _), path in index.files.items():
+        try:
+            stat = os.stat(path)
+        except OSError: # Deleted between the scan and now, the next poll picks it up
+            continue
+        snapshot[(name, path)] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+def watch(config, jobs=1, interval=0.25, debounce=0.5): # Keep converting the materials whose source maps change, until interrupted
+    settings = get_settings(config)
+    apply_settings(settings)
+    if not jobs or jobs < 1:
+        jobs = os.cpu_count() or 1
+    executor = futures.ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None # Started once, so the workers stay warm between saves
+    try:
+        snapshot = snapshot_inputs(settings) # Taken first, so saves during the first run get picked up afterwards
+        run_conversion(config, jobs, executor=executor) # Catch up on everything that changed while nobody was watching
+        pending = set()
+        last_change = 0
+        print(f"[FVM] Watching '{settings['input_path']}' for changes, press Ctrl+C to stop")
+        while True:
+            time.sleep(interval)
+            current = snapshot_inputs(settings)
+            changed = {name for (name, path), state in current.items() if snapshot.get((name, path)) != state}
+            changed |= {name for (name, path) in snapshot if (name, path) not in current} # A removed map can change which defaults get used
+            snapshot = current
+            if changed:
+                pending |= changed
+                last_change = time.monotonic()
+                continue
+            if pending and time.monotonic() - last_change >= debounce: # Wait until the burst of saves is over, editors often write a file several times
+                debug("Changed: " + ", ".join(sorted(pending)))
+                start = time.perf_counter()
+                failures = run_conversion(config, jobs, only=pending, executor=executor)
+                pending = set()
+                print(f"[FVM] Updated in {time.perf_counter() - start:.2f}s" + (f", {len(failures)} failed" if failures else ""))
+    except KeyboardInterrupt:
+        print("[FVM] Stopped watching")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+# /////////////////////
+# * Main loop
+# /////////////////////
+def get_help_formatter(prog): # argparse imports shutil (and with it bz2 and lzma) just to look up the terminal width, which every run would pay for
+    try:
+        width = os.get_terminal_size().columns
+    except OSError:
+        width = 80
+    return argparse.HelpFormatter(prog, width=width - 2)
+
+def main(): # Command line entry point, FastValveMaterial.py calls this
+    print(f"FastValveMaterial (v{VERSION})\n")
+
+    parser = argparse.ArgumentParser(formatter_class=get_help_formatter)
+    parser.add_argument("--config")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of materials to convert in parallel (0 = one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Reconvert every material, even if its inputs and settings didn't change")
+    parser.add_argument("--prune", action="store_true", help="Delete outputs of materials that were removed from the input folder")
+    parser.add_argument("--profile", metavar="FILE", help="Append the time, CPU time, bytes read/written and peak memory of every stage to FILE as JSON lines")
+    parser.add_argument("--watch", action="store_true", help="Keep running and reconvert materials whenever their source maps change")
+    parser.add_argument("--interval", type=float, default=0.25, help="Seconds between checks for changes in watch mode")
+    parser.add_argument("--debounce", type=float, default=0.5, help="Seconds without further changes before converting in watch mode")
+    args = parser.parse_args()
+
+    if args.config:
+        config = get_config(args.config)
+    else:
+        config = get_default_config()
+
+    if args.profile:
+        profile_writer = profiler.JSONLinesWriter(args.profile)
+        profiler.add_hook(profile_writer)
+    if args.watch:
+        watch(config, args.jobs, args.interval, args.debounce)
+        failures = {}
+    else:
+        failures = run_conversion(config, args.jobs, args.force, args.prune)
+    if args.profile:
+        profiler.remove_hook(profile_writer)
+        profile_writer.close()
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
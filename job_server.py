@@ -0,0 +1,173 @@
+""" Local job server for FastValveMaterial
+
+Keeps a pool of warm worker processes (imports loaded, VTF backend set up) and
+accepts conversion jobs over HTTP on localhost, so build scripts and DCC
+plugins don't pay for a new Python process per material.
+
+    python job_server.py --port 8271 --jobs 4 --config config.ini
+
+POST /convert with a JSON body:
+    {"name": "crate",                     # Material name
+     "textures": {"color": "...", ...},    # Optional, looked up in the input path otherwise
+     "settings": {"output_path": "...", ...},  # Optional, overrides the server's config
+     "outputs": ["diffuse", "material"],   # Optional, everything by default
+     "write": true}                        # Write to the output path, or return the files base64 encoded
+returns {"error": null, "files": {...}} or {"error": null, "data": {...}}.
+GET /status returns the server version and the number of jobs in flight.
+"""
+
+import os
+import json
+import base64
+import signal
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import fvm_core as FVM
+    import fvm_api
+except ImportError:
+    from . import fvm_core as FVM
+    from . import fvm_api
+
+def check_request(request): # Raise ValueError if the fields of a /convert request have the wrong types
+    if not isinstance(request, dict) or not isinstance(request.get("name"), str):
+        raise ValueError("The request needs a material \"name\"")
+    if not isinstance(request.get("settings", {}), dict):
+        raise ValueError("\"settings\" has to be an object")
+    textures = request.get("textures")
+    if textures is not None and (not isinstance(textures, dict) or not all(path is None or isinstance(path, str) for path in textures.values())):
+        raise ValueError("\"textures\" has to be an object of paths")
+    outputs = request.get("outputs")
+    if outputs is not None and (not isinstance(outputs, list) or not all(isinstance(output, str) for output in outputs)):
+        raise ValueError("\"outputs\" has to be a list of output names")
+    if not isinstance(request.get("write", True), bool):
+        raise ValueError("\"write\" has to be true or false")
+    check_settings(request.get("settings", {}))
+
+SETTING_CHOICES = {"material_setup": ("rough", "gloss"), "vtf_backend": ("auto", "vtflib", "numpy")}
+
+def check_settings(settings): # Raise ValueError if a setting has the wrong type or value, so it's a bad request instead of a failed job
+    defaults = fvm_api.ConversionSettings()
+    for name, value in settings.items():
+        if not hasattr(defaults, name):
+            raise ValueError(f"Unknown setting \"{name}\"")
+        expected = type(getattr(defaults, name))
+        if name == "midtone" and isinstance(value, str): # Like GammaAdjustment in the config file
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError("Setting \"midtone\" has to be a number") from None
+        if expected is float and type(value) is int: # JSON doesn't tell 1 and 1.0 apart
+            continue
+        if type(value) is not expected:
+            raise ValueError(f"Setting \"{name}\" has to be {'a number' if expected in (int, float) else f'of type {expected.__name__}'}")
+        if name == "midtone" and not 0 <= value <= 255:
+            raise ValueError("Setting \"midtone\" has to be between 0 and 255")
+        if name in SETTING_CHOICES and value not in SETTING_CHOICES[name]:
+            raise ValueError(f"Setting \"{name}\" has to be one of {', '.join(SETTING_CHOICES[name])}")
+        if name == "mip_filter" and value not in FVM.resample.FILTERS:
+            raise ValueError(f"Setting \"mip_filter\" has to be one of {', '.join(FVM.resample.FILTERS)}")
+        if name == "suffixes" and not all(isinstance(suffix, str) for suffix in value.values()):
+            raise ValueError("Setting \"suffixes\" has to map map names to strings")
+
+def init_worker(): # Ctrl+C is handled by the server, which shuts the workers down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def make_executor(jobs): # Workers are started from request threads, forking a process with threads can deadlock them, so they're spawned
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, mp_context=multiprocessing.get_context("spawn"))
+
+class JobServer(ThreadingHTTPServer): # Every request gets a thread, the conversions themselves run in the process pool
+    daemon_threads = True
+
+    def __init__(self, address, settings, jobs):
+        super().__init__(address, JobHandler)
+        self.settings = settings
+        self.executor = make_executor(jobs)
+        self.jobs = jobs
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, request):
+        settings = dict(self.settings, **request.get("settings", {}))
+        with self.lock:
+            self.pending += 1
+        executor = self.executor
+        try:
+            future = executor.submit(fvm_api.convert_material_job, request["name"], settings,
+                                     request.get("textures"), request.get("outputs"), request.get("write", True))
+            return future.result()
+        except Exception as e: # The job itself never raises, this is the pool failing, e.g. a worker that crashed
+            if isinstance(e, BrokenProcessPool):
+                with self.lock: # A broken pool refuses every further job, start a new one for the next requests
+                    if self.executor is executor:
+                        self.executor = make_executor(self.jobs)
+            return {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+class JobHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        self.send_json(200, {"version": FVM.VERSION, "jobs": self.server.jobs, "pending": self.server.pending})
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self.send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            check_request(request)
+        except ValueError as e:
+            self.send_json(400, {"error": f"Bad request: {e}"})
+            return
+        result = self.server.submit(request)
+        if "data" in result: # Bytes and arrays don't fit into JSON
+            result["data"] = {output: base64.b64encode(data).decode() for output, data in result["data"].items()}
+        self.send_json(200 if result["error"] is None else 500, result)
+
+    def log_message(self, format, *args):
+        FVM.debug("Job server: " + format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve FastValveMaterial conversions on localhost")
+    parser.add_argument("--config", help="Config file with the default settings of every job")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8271)
+    parser.add_argument("--jobs", type=int, default=0, help="Worker processes (0 = one per CPU)")
+    args = parser.parse_args()
+
+    config = FVM.get_config(args.config) if args.config else FVM.get_default_config()
+    settings = fvm_api.ConversionSettings.from_config(config).as_settings()
+    FVM.apply_settings(settings)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    server = JobServer((args.host, args.port), settings, jobs)
+    print(f"[FVM] Job server v{FVM.VERSION} listening on http://{args.host}:{server.server_address[1]} with {jobs} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[FVM] Job server stopped")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
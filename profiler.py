@@ -0,0 +1,120 @@
+""" Per-stage instrumentation for FastValveMaterial
+
+Stages are wrapped in "with profiler.stage(name, material):". While profiling
+is off that returns a shared no-op context, so the only cost is a function
+call. While it's on, every stage produces a record with its wall time, CPU
+time, bytes read/written and peak traced memory. Records are collected per
+process (worker processes hand them back to the parent) and passed to every
+registered hook, e.g. a JSONLinesWriter for "--profile".
+"""
+
+import os
+import json
+import time
+
+tracemalloc = None # Imported by enable, runs without profiling don't need it
+ENABLED = False
+HOOKS = []
+RECORDS = [] # Collected records of this process, see take_records
+STACK = [] # Stages that are currently running, innermost last
+
+class NullStage: # Stand-in while profiling is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_read(self, *paths):
+        pass
+
+    def add_written(self, *paths):
+        pass
+
+NULL_STAGE = NullStage()
+
+class Stage:
+    def __init__(self, name, material):
+        self.record = {"material": material, "stage": name, "bytes_read": 0, "bytes_written": 0}
+        self.peak = 0
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if STACK: # The peak counter gets reset below, hand what the outer stage reached so far to it first
+            STACK[-1].peak = max(STACK[-1].peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        STACK.append(self)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["wall_seconds"] = time.perf_counter() - self.start_wall
+        self.record["cpu_seconds"] = time.process_time() - self.start_cpu
+        STACK.pop()
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        if STACK:
+            STACK[-1].peak = max(STACK[-1].peak, self.peak)
+        self.record["peak_mb"] = self.peak / (1 << 20)
+        self.record["failed"] = exc_type is not None
+        self.record["pid"] = os.getpid()
+        self.record["time"] = time.time()
+        RECORDS.append(self.record)
+        return False
+
+    def add_read(self, *paths): # Count the size of files the stage read, paths can be None for maps that aren't set
+        self.record["bytes_read"] += sum(file_size(path) for path in paths if path)
+
+    def add_written(self, *paths):
+        self.record["bytes_written"] += sum(file_size(path) for path in paths if path)
+
+def stage(name, material=None):
+    if not ENABLED:
+        return NULL_STAGE
+    return Stage(name, material)
+
+def file_size(path): # Size of a file for the byte counters, 0 if it's missing
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def enable(enabled=True): # Turn recording on or off for this process, worker processes call this from apply_settings
+    global ENABLED, tracemalloc
+    ENABLED = enabled
+    if enabled and tracemalloc is None:
+        import tracemalloc
+    if not enabled and tracemalloc is not None and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def add_hook(callback): # callback(record) is called in the parent process for every finished stage
+    HOOKS.append(callback)
+    enable()
+
+def remove_hook(callback):
+    HOOKS.remove(callback)
+    if not HOOKS:
+        enable(False)
+
+def take_records(): # Records collected since the last call, used to send a worker's records back to the parent
+    records = RECORDS[:]
+    RECORDS.clear()
+    return records
+
+def emit(records): # Pass records to every hook
+    for record in records:
+        for hook in HOOKS:
+            hook(record)
+
+class JSONLinesWriter: # Hook that appends every record as one JSON line, so files of several runs can simply be concatenated
+    def __init__(self, path, run_id=None):
+        import socket
+        self.file = open(path, 'a')
+        self.run_id = run_id or f"{socket.gethostname()}-{os.getpid()}-{time.strftime('%Y%m%dT%H%M%S')}" # Tells the runs on a farm apart
+
+    def __call__(self, record):
+        self.file.write(json.dumps(dict(record, run=self.run_id), sort_keys=True) + "\n")
+
+    def close(self):
+        self.file.close()
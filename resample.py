@@ -0,0 +1,136 @@
+""" Resampling for FastValveMaterial
+
+Power of two resizing and mip chain generation on numpy arrays, with a choice
+of filters. Filters are separable and applied one axis at a time as a few
+shifted, weighted sums, so the whole image is processed at once. The default
+box filter keeps the exact integer averaging the encoder always used.
+
+Normal map mips can be renormalised to unit length, and alpha mips can be
+scaled so the share of pixels above a threshold stays the same as in the full
+size image (alpha coverage), so masks don't fade out in the distance.
+"""
+
+import numpy as np
+
+FILTERS = ("box", "triangle", "kaiser", "lanczos")
+FILTER_SUPPORT = {"box": 0.5, "triangle": 1.0, "kaiser": 3.0, "lanczos": 3.0} # Radius of each filter in source pixels, before stretching
+KAISER_ALPHA = 4.0
+COVERAGE_STEPS = 12 # Binary search steps for the alpha scale, plenty for 8-bit alpha
+
+def filter_weights(x, name): # The filter kernel at the (float array) distances "x"
+    x = np.abs(x)
+    if name == "box":
+        return (x < 0.5).astype(np.float32)
+    if name == "triangle":
+        return np.maximum(1 - x, 0)
+    if name == "lanczos":
+        return np.where(x < 3, np.sinc(x) * np.sinc(x / 3), 0)
+    if name == "kaiser": # Windowed sinc like the one NVTT uses for mipmaps
+        ratio = np.clip(x / FILTER_SUPPORT["kaiser"], 0, 1)
+        return np.where(x < FILTER_SUPPORT["kaiser"], np.sinc(x) * np.i0(KAISER_ALPHA * np.sqrt(1 - ratio ** 2)) / np.i0(KAISER_ALPHA), 0)
+    raise ValueError(f"Unknown filter '{name}', use one of {', '.join(FILTERS)}")
+
+def get_taps(in_size, out_size, name): # (source indices, weights), both (out_size, taps), for resampling one axis
+    scale = in_size / out_size
+    stretch = max(scale, 1.0) # Downscaling widens the filter so every source pixel contributes
+    support = FILTER_SUPPORT[name] * stretch
+    centers = (np.arange(out_size) + 0.5) * scale - 0.5
+    first = np.floor(centers - support).astype(np.int64)
+    taps = int(np.ceil(support * 2)) + 2
+    indices = first[:, None] + np.arange(taps)
+    weights = filter_weights((indices - centers[:, None]) / stretch, name).astype(np.float32)
+    weights /= weights.sum(axis=1, keepdims=True)
+    used = np.any(weights != 0, axis=0) # Drop taps that are zero for every output pixel
+    return np.clip(indices[:, used], 0, in_size - 1), weights[:, used] # Clamping repeats the edge pixels
+
+def resample_axis(data, out_size, axis, name): # Resample a float32 array along "axis"
+    in_size = data.shape[axis]
+    if in_size == out_size:
+        return data
+    indices, weights = get_taps(in_size, out_size, name)
+    data = np.moveaxis(data, axis, 0)
+    out = np.zeros((out_size,) + data.shape[1:], dtype=np.float32)
+    shape = (out_size,) + (1,) * (data.ndim - 1)
+    for tap in range(indices.shape[1]):
+        out += weights[:, tap].reshape(shape) * data[indices[:, tap]]
+    return np.moveaxis(out, 0, axis)
+
+def to_uint8(data):
+    return np.clip(data + 0.5, 0, 255).astype(np.uint8)
+
+def resize(image_data, width, height, name="triangle"): # Resize a (height, width, channels) uint8 array
+    data = np.asarray(image_data, dtype=np.float32)
+    data = resample_axis(data, height, 0, name)
+    data = resample_axis(data, width, 1, name)
+    return to_uint8(data)
+
+def nearest_power_of_two(value):
+    lower = 1 << (max(1, value).bit_length() - 1)
+    return lower if value - lower < lower * 2 - value else lower * 2
+
+def resize_power_of_two(image_data, name="triangle"): # Same as VTFLib's "Resize" option with the nearest power of two
+    height, width = image_data.shape[:2]
+    new_width, new_height = nearest_power_of_two(width), nearest_power_of_two(height)
+    if (new_width, new_height) == (width, height):
+        return image_data
+    return resize(image_data, new_width, new_height, name)
+
+def downsample(image_data): # Box filter the image down to the next mip level
+    data = image_data.astype(np.uint16)
+    height, width = data.shape[:2]
+    if height > 1:
+        data = data[0:height & ~1:2] + data[1:height & ~1:2]
+    else:
+        data = data * 2
+    if width > 1:
+        data = data[:, 0:width & ~1:2] + data[:, 1:width & ~1:2]
+    else:
+        data = data * 2
+    return ((data + 2) >> 2).astype(np.uint8)
+
+def renormalize(data): # Scale the RGB normals of a float RGBA array (0-255) back to unit length, alpha is left alone
+    normals = data[..., :3] / 127.5 - 1
+    length = np.sqrt(np.sum(normals * normals, axis=-1, keepdims=True))
+    data[..., :3] = (normals / np.maximum(length, 1e-6) + 1) * 127.5
+    return data
+
+def get_coverage(alpha, threshold):
+    return float(np.mean(alpha > threshold))
+
+def preserve_coverage(alpha, coverage, threshold): # Scale "alpha" so get_coverage matches "coverage" again
+    if get_coverage(alpha, threshold) == coverage: # Also keeps fully covered and fully empty levels as they are
+        return alpha
+    low, high = 0.0, 4.0
+    for _ in range(COVERAGE_STEPS):
+        scale = (low + high) / 2
+        if get_coverage(np.minimum(alpha * scale, 255), threshold) < coverage:
+            low = scale
+        else:
+            high = scale
+    return np.minimum(alpha * (low + high) / 2, 255)
+
+def generate_mipmaps(image_data, name="box", normal_map=False, alpha_threshold=None): # Full mip chain of an RGBA array down to 1x1, largest first
+    if name not in FILTERS:
+        raise ValueError(f"Unknown filter '{name}', use one of {', '.join(FILTERS)}")
+    if name == "box" and not normal_map and alpha_threshold is None:
+        mipmaps = [image_data]
+        while max(mipmaps[-1].shape[:2]) > 1:
+            mipmaps.append(downsample(mipmaps[-1]))
+        return mipmaps
+
+    mipmaps = [image_data]
+    if alpha_threshold is not None:
+        coverage = get_coverage(image_data[..., 3], alpha_threshold)
+    data = image_data.astype(np.float32) # Every level is filtered from the unrounded one above it
+    while max(data.shape[:2]) > 1:
+        height, width = data.shape[:2]
+        data = resample_axis(data, max(1, height // 2), 0, name)
+        data = resample_axis(data, max(1, width // 2), 1, name)
+        if normal_map:
+            data = renormalize(data)
+        level = data
+        if alpha_threshold is not None: # Only the stored level, the next one is still filtered from the original alpha
+            level = data.copy()
+            level[..., 3] = preserve_coverage(data[..., 3], coverage, alpha_threshold)
+        mipmaps.append(to_uint8(level))
+    return mipmaps
@@ -1,9 +1,215 @@
-import VTFLibWrapper.VTFLib as VTFLib
-import VTFLibWrapper.VTFLibEnums as VTFLibEnums
+""" VTF inspection tool for FastValveMaterial
+
+Walks folders of VTF files and reads only the header of each one, so even
+big trees are checked in seconds. Reports the format, size, mip count and
+flags of every texture and flags textures that aren't a power of two, are
+bigger than --max-size, have an incomplete mip chain or are cut off.
+With --downscale the offenders are shrunk in place by a pool of worker
+processes: oversized power of two textures just lose their largest mips
+(no re-encoding), everything else is decoded, resized and encoded again.
+
+Usage:
+    python resize.py materials/ --max-size 2048 --report vtf_report.json
+    python resize.py materials/ --max-size 2048 --downscale --jobs 8
+"""
+
 import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    import vtf_writer
+    import resample
+    import fvm_core as FVM
+except ImportError:
+    from . import vtf_writer, resample
+    from . import fvm_core as FVM
+
+FORMAT_NAMES = ("RGBA8888", "ABGR8888", "RGB888", "BGR888", "RGB565", "I8", "IA88", "P8", "A8", "RGB888_BLUESCREEN",
+                "BGR888_BLUESCREEN", "ARGB8888", "BGRA8888", "DXT1", "DXT3", "DXT5", "BGRX8888", "BGR565", "BGRX5551",
+                "BGRA4444", "DXT1_ONEBITALPHA", "BGRA5551", "UV88", "UVWQ8888", "RGBA16161616F", "RGBA16161616", "UVLX8888") # Indexed by VTFLibEnums.ImageFormat
+FLAG_NAMES = {0x1: "POINTSAMPLE", 0x2: "TRILINEAR", 0x4: "CLAMPS", 0x8: "CLAMPT", 0x10: "ANISOTROPIC", 0x20: "HINT_DXT5",
+              0x40: "NOCOMPRESS", 0x80: "NORMAL", 0x100: "NOMIP", 0x200: "NOLOD", 0x400: "MINMIP", 0x800: "PROCEDURAL",
+              0x1000: "ONEBITALPHA", 0x2000: "EIGHTBITALPHA", 0x4000: "ENVMAP", 0x8000: "RENDERTARGET",
+              0x10000: "DEPTHRENDERTARGET", 0x20000: "NODEBUGOVERRIDE", 0x40000: "SINGLECOPY"}
+FLAG_NOMIP = 0x100
+FLAG_ENVMAP = 0x4000
+DEFAULT_MAX_SIZE = 4096 # Largest texture size the Source engine loads
+ISSUES = ("not_power_of_two", "oversized", "incomplete_mipmaps", "truncated", "unreadable")
+
+def find_vtf_files(paths): # Every .vtf file under the given files and folders, sorted so reports are stable
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for folder, _, names in os.walk(path):
+            files.extend(os.path.join(folder, name) for name in names if name.lower().endswith(".vtf"))
+    return sorted(files)
+
+def get_format_name(vtf_format):
+    return FORMAT_NAMES[vtf_format] if 0 <= vtf_format < len(FORMAT_NAMES) else str(vtf_format)
+
+def get_flag_names(flags): # Names of the set flags, unknown bits as hex
+    names = [name for bit, name in FLAG_NAMES.items() if flags & bit]
+    unknown = flags & ~sum(FLAG_NAMES)
+    return names + ([hex(unknown)] if unknown else [])
+
+def get_expected_size(header): # File size of a texture without resources, None if it can't be worked out from the header
+    if header["version"] > (7, 2) or header["flags"] & FLAG_ENVMAP: # Resources and cube map faces aren't covered
+        return None
+    try:
+        size = header["header_size"]
+        if header["thumbnail_format"] != vtf_writer.IMAGE_FORMAT_NONE:
+            size += vtf_writer.get_image_size(header["thumbnail_width"], header["thumbnail_height"], header["thumbnail_format"])
+        for level in range(header["mipmap_count"]):
+            width, height = max(1, header["width"] >> level), max(1, header["height"] >> level)
+            size += vtf_writer.get_image_size(width, height, header["format"]) * header["frames"] * max(1, header["depth"] >> level)
+    except ValueError: # Formats the built-in encoder doesn't know
+        return None
+    return size
+
+def inspect_file(path, max_size): # Header summary of a single VTF and the problems found in it, the pixel data isn't read
+    entry = {"path": path}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(vtf_writer.HEADER_SIZE)
+            file_size = os.fstat(f.fileno()).st_size
+        header = vtf_writer.read_vtf_header(data)
+    except (OSError, ValueError) as e:
+        entry["issues"] = ["unreadable"]
+        entry["error"] = str(e)
+        return entry
+    width, height = header["width"], header["height"]
+    entry.update({
+        "version": "{}.{}".format(*header["version"]),
+        "format": get_format_name(header["format"]),
+        "width": width,
+        "height": height,
+        "mipmap_count": header["mipmap_count"],
+        "frames": header["frames"],
+        "flags": get_flag_names(header["flags"]),
+        "file_size": file_size,
+    })
+    issues = []
+    if not (vtf_writer.is_power_of_two(width) and vtf_writer.is_power_of_two(height)):
+        issues.append("not_power_of_two")
+    if max(width, height) > max_size:
+        issues.append("oversized")
+    if not header["flags"] & FLAG_NOMIP and header["mipmap_count"] < vtf_writer.get_mipmap_count(width, height):
+        issues.append("incomplete_mipmaps")
+    expected_size = get_expected_size(header)
+    if expected_size is not None and file_size < expected_size:
+        issues.append("truncated")
+    entry["issues"] = issues
+    return entry
+
+def inspect_files(paths, max_size, jobs=None): # Opening files is what takes time, so threads are enough to keep the disk busy
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(inspect_file, paths, [max_size] * len(paths)))
+
+def get_target_size(width, height, max_size): # Nearest power of two size that fits into max_size, keeping the aspect ratio
+    width, height = resample.nearest_power_of_two(width), resample.nearest_power_of_two(height)
+    while max(width, height) > max_size:
+        width, height = max(1, width // 2), max(1, height // 2) # Like the next mip level
+    return width, height
+
+def drop_mipmaps(data, header, levels): # The VTF without its "levels" largest mips, the remaining data is kept as it is
+    end = len(data)
+    for level in range(levels): # Mips are stored smallest first, so the largest ones are at the end
+        end -= vtf_writer.get_image_size(max(1, header["width"] >> level), max(1, header["height"] >> level), header["format"])
+    values = list(vtf_writer.HEADER_STRUCT.unpack_from(data))
+    values[4] = max(1, header["width"] >> levels) # Width, height and mip count fields of HEADER_STRUCT
+    values[5] = max(1, header["height"] >> levels)
+    values[14] = header["mipmap_count"] - levels
+    return vtf_writer.HEADER_STRUCT.pack(*values) + data[vtf_writer.HEADER_STRUCT.size:end]
+
+def downscale_file(path, max_size): # Shrink a single VTF to a power of two within max_size, returns (new width, new height, error)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        header = vtf_writer.read_vtf_header(data)
+        width, height = header["width"], header["height"]
+        if header["version"] != vtf_writer.VTF_VERSION or header["frames"] != 1 or header["depth"] != 1 or header["flags"] & FLAG_ENVMAP:
+            return width, height, "Only single frame 7.2 textures can be downscaled"
+        if get_expected_size(header) != len(data):
+            return width, height, "Unsupported format or unexpected data size"
+        new_width, new_height = get_target_size(width, height, max_size)
+        if (new_width, new_height) == (width, height):
+            return width, height, None
+        levels = (max(width, height) // max(new_width, new_height)).bit_length() - 1
+        if vtf_writer.is_power_of_two(width) and vtf_writer.is_power_of_two(height) and levels < header["mipmap_count"]:
+            FVM.write_output(path, drop_mipmaps(data, header, levels))
+        else:
+            _, mipmaps = vtf_writer.read_vtf(data)
+            image_data = resample.resize(mipmaps[0], new_width, new_height)
+            levels = [image_data] if header["flags"] & FLAG_NOMIP else None # write_vtf would otherwise add a mip chain the flags say isn't there
+            FVM.write_output(path, vtf_writer.write_vtf(image_data, header["format"], header["flags"], resize=False, mipmaps=levels))
+        return new_width, new_height, None
+    except (OSError, ValueError) as e:
+        return None, None, str(e)
+
+def downscale_files(entries, max_size, jobs=None): # Downscale every entry that is oversized or not a power of two, updates the entries in place
+    offenders = [entry for entry in entries if {"oversized", "not_power_of_two"} & set(entry["issues"]) and "truncated" not in entry["issues"]]
+    if not offenders:
+        return 0
+    paths = [entry["path"] for entry in offenders]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(downscale_file, paths, [max_size] * len(paths), chunksize=16))
+    fixed = []
+    for entry, (width, height, error) in zip(offenders, results):
+        if error:
+            entry["downscale_error"] = error
+            print(f"[FVM] [ERROR] Could not downscale '{entry['path']}': {error}")
+            continue
+        print(f"[FVM] Downscaled '{entry['path']}' from {entry['width']}x{entry['height']} to {width}x{height}")
+        fixed.append(entry)
+    for entry, new_entry in zip(fixed, inspect_files([entry["path"] for entry in fixed], max_size, jobs)): # Re-encoding can also change the mips and flags, so report the files as written
+        downscaled_from = [entry["width"], entry["height"]]
+        entry.clear()
+        entry.update(new_entry, downscaled_from=downscaled_from)
+    return len(fixed)
+
+def summarize(entries): # Counts per format and per issue
+    summary = {"files": len(entries), "formats": {}, "issues": {issue: 0 for issue in ISSUES}}
+    for entry in entries:
+        if "format" in entry:
+            summary["formats"][entry["format"]] = summary["formats"].get(entry["format"], 0) + 1
+        for issue in entry["issues"]:
+            summary["issues"][issue] += 1
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the headers of VTF files and optionally downscale the ones that are too big or not a power of two")
+    parser.add_argument("paths", nargs="*", default=["."], help="VTF files or folders to search (recursively)")
+    parser.add_argument("--max-size", type=int, default=DEFAULT_MAX_SIZE, help="Largest allowed width or height")
+    parser.add_argument("--downscale", action="store_true", help="Shrink oversized and non power of two textures in place")
+    parser.add_argument("--jobs", type=int, default=0, help="Worker threads for reading headers and processes for downscaling (0 = the pools' defaults)")
+    parser.add_argument("--report", help="JSON file to write the full report to")
+    parser.add_argument("--verbose", action="store_true", help="List every texture, not just the ones with issues")
+    args = parser.parse_args()
+
+    jobs = args.jobs if args.jobs > 0 else None
+    entries = inspect_files(find_vtf_files(args.paths), args.max_size, jobs)
+    if args.downscale:
+        downscale_files(entries, args.max_size, jobs)
 
-vtf_lib = VTFLib.VTFLib()
+    for entry in entries:
+        if entry["issues"] or args.verbose:
+            if "format" in entry:
+                details = f"{entry['format']} {entry['width']}x{entry['height']}, {entry['mipmap_count']} mips, flags {'|'.join(entry['flags']) or '0'}"
+            else:
+                details = entry["error"]
+            print(f"{entry['path']}: {details}" + (f" [{', '.join(entry['issues'])}]" if entry["issues"] else ""))
+    summary = summarize(entries)
+    found = ", ".join(f"{count} {issue}" for issue, count in summary["issues"].items() if count)
+    print(f"[FVM] Checked {summary['files']} textures, " + (found or "no issues found"))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({"max_size": args.max_size, "summary": summary, "files": entries}, f, indent=1)
+    sys.exit(1 if any(summary["issues"].values()) else 0)
 
-for file in os.listdir():
-    if vtf_lib.image_load(file): # if is vtf
-        print(file)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
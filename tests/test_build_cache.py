@@ -0,0 +1,84 @@
+""" Incremental rebuild manifest tests
+
+A changed source map only makes the outputs it feeds into stale, and pruning
+removes exactly the outputs of materials that are gone.
+"""
+
+import os
+
+import pytest
+
+import build_cache
+import fvm_core as FVM
+
+VERSION = "test"
+
+def make_material(folder, name, roles):
+    textures = {}
+    for role in ("color", "ao", "normal", "roughness", "metal"):
+        textures[role] = None
+        if role in roles:
+            textures[role] = str(folder / f"{name}_{role}.png")
+            with open(textures[role], 'wb') as f:
+                f.write(role.encode())
+    return textures
+
+def make_outputs(folder, name):
+    outputs = {output: str(folder / f"{name}_{output}") for output in ("diffuse", "exponent", "normal", "material")}
+    for path in outputs.values():
+        open(path, 'wb').close()
+    return outputs
+
+def edit(path): # New content and a new modification time, so the old hash can't be reused
+    with open(path, 'ab') as f:
+        f.write(b"changed")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+@pytest.fixture
+def settings():
+    settings = FVM.get_settings(FVM.get_default_config())
+    settings.update(templates_hash="", texture_store=None)
+    return settings
+
+@pytest.mark.parametrize("roles, edited, stale", [
+    (("color", "ao", "normal", "roughness", "metal"), "roughness", {"exponent", "normal"}), # With AO the gloss map doesn't reach the diffuse
+    (("color", "normal", "roughness", "metal"), "roughness", {"diffuse", "exponent", "normal"}),
+    (("color", "ao", "normal", "roughness", "metal"), "ao", {"diffuse"}),
+    (("color", "ao", "normal", "roughness", "metal"), "normal", {"diffuse", "exponent", "normal"}), # Everything gets scaled to the normal map
+    (("color", "ao", "normal", "roughness", "metal"), "metal", {"diffuse"}),
+])
+def test_plan_material(tmp_path, settings, roles, edited, stale):
+    textures = make_material(tmp_path, "rock", roles)
+    outputs = make_outputs(tmp_path, "rock")
+    planned, record = build_cache.plan_material(None, settings, textures, outputs, VERSION)
+    assert planned == set(outputs)
+    assert build_cache.plan_material(record, settings, textures, outputs, VERSION, record["inputs"])[0] == set()
+    edit(textures[edited])
+    assert build_cache.plan_material(record, settings, textures, outputs, VERSION, record["inputs"])[0] == stale
+
+def test_plan_material_settings(tmp_path, settings):
+    textures = make_material(tmp_path, "rock", ("color", "ao", "normal", "roughness", "metal"))
+    outputs = make_outputs(tmp_path, "rock")
+    _, record = build_cache.plan_material(None, settings, textures, outputs, VERSION)
+    assert build_cache.plan_material(record, dict(settings, midtone="200"), textures, outputs, VERSION)[0] == {"normal", "material"}
+    os.remove(outputs["exponent"])
+    assert build_cache.plan_material(record, settings, textures, outputs, VERSION)[0] == {"exponent"}
+
+def test_prune(tmp_path, settings):
+    manifest = {"version": build_cache.MANIFEST_VERSION, "materials": {}}
+    for name in ("rock", "rock2", "wood"):
+        textures = make_material(tmp_path, name, ("color", "normal"))
+        manifest["materials"][name] = build_cache.plan_material(None, settings, textures, make_outputs(tmp_path, name), VERSION)[1]
+    removed = build_cache.prune(manifest, ["rock"])
+    assert sorted(removed) == sorted(str(tmp_path / f"{name}_{output}") for name in ("rock2", "wood") for output in ("diffuse", "exponent", "normal", "material"))
+    assert list(manifest["materials"]) == ["rock"]
+    assert sorted(os.listdir(tmp_path)) == sorted(["rock_color.png", "rock_normal.png", "rock2_color.png", "rock2_normal.png", "wood_color.png", "wood_normal.png"]
+                                                  + [f"rock_{output}" for output in ("diffuse", "exponent", "normal", "material")])
+
+def test_stale_files(tmp_path, settings):
+    textures = make_material(tmp_path, "rock", ("color", "normal"))
+    outputs = make_outputs(tmp_path, "rock")
+    _, old_record = build_cache.plan_material(None, settings, textures, outputs, VERSION)
+    _, new_record = build_cache.plan_material(None, settings, textures, dict(outputs, material=str(tmp_path / "rock_s.vmt")), VERSION)
+    assert build_cache.get_stale_files(old_record, new_record) == [outputs["material"]]
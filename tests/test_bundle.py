@@ -0,0 +1,55 @@
+""" Tiled TextureBundle tests
+
+In tiled mode the gloss map is inverted and mismatched maps are scaled one
+band of rows at a time. Put back together, the tiles have to match the
+full size maps of the untiled bundle exactly. Textures the encoder can't
+stream tile by tile have to say so.
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import fvm_core as FVM
+
+def save_map(folder, name, size, mode, seed):
+    channels = len(mode)
+    data = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], channels), dtype=np.uint8)
+    path = str(folder / name)
+    Image.fromarray(data[..., 0] if channels == 1 else data, mode).save(path)
+    return path
+
+@pytest.mark.parametrize("other_size", [(64, 64), (32, 32), (160, 160), (50, 50)]) # Same size, upscaled, downscaled, fractional scale
+@pytest.mark.parametrize("orm", [False, True])
+@pytest.mark.parametrize("material_setup", ["rough", "gloss"])
+def test_tiles_match_full_maps(tmp_path, monkeypatch, other_size, orm, material_setup):
+    textures = {
+        "color": save_map(tmp_path, "c.png", other_size, "RGB", 1),
+        "normal": save_map(tmp_path, "n.png", (64, 64), "RGBA", 2),
+        "ao": save_map(tmp_path, "a.png", other_size, "L", 3),
+        "roughness": save_map(tmp_path, "r.png", other_size, "RGBA", 4),
+        "metal": save_map(tmp_path, "m.png", (other_size[0] // 2, other_size[1] // 2), "L", 5),
+        "orm": save_map(tmp_path, "o.png", other_size, "RGB", 6),
+    }
+    if orm:
+        textures = {role: textures[role] for role in ("color", "normal", "orm")}
+    settings = dict(FVM.get_settings(FVM.get_default_config()), orm=orm, material_setup=material_setup)
+    monkeypatch.setattr(FVM, "TILE_BUDGET", 0)
+    full = FVM.TextureBundle(textures, settings)
+    monkeypatch.setattr(FVM, "TILE_BUDGET", 1)
+    tiled = FVM.TextureBundle(textures, settings)
+    for role in ("color", "ao", "normal", "gloss", "metal"):
+        for mode in ("RGB", "RGBA", "L"):
+            tiles = [tiled.get_tile(role, mode, rows) for rows in FVM.row_slices(full.size[1], 12)]
+            np.testing.assert_array_equal(np.concatenate(tiles), full.get(role, mode))
+
+@pytest.mark.parametrize("size, mip_filter, warned", [((64, 64), "box", False), ((64, 48), "box", True), ((64, 64), "kaiser", True)])
+def test_untiled_fallback_warns(tmp_path, monkeypatch, capsys, size, mip_filter, warned):
+    monkeypatch.setattr(FVM, "TILE_BUDGET", 1)
+    monkeypatch.setattr(FVM, "VTF_BACKEND", "numpy")
+    monkeypatch.setattr(FVM, "MIP_FILTER", mip_filter)
+    monkeypatch.setattr(FVM, "TEXTURE_STORE", None)
+    monkeypatch.setattr(FVM, "WARNED", set())
+    texture = np.random.default_rng(1).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    FVM.export_texture_tiles(size, lambda rows: texture[rows], str(tmp_path / "a_c.vtf"), "DXT5")
+    assert ("[WARNING]" in capsys.readouterr().out) == warned
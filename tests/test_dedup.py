@@ -0,0 +1,88 @@
+""" Texture store tests
+
+With DedupTextures on, identical textures are encoded once into the texture
+store and every output is a hard link to the stored file. Outputs must never
+be left unwritten, not even when another run cleans the store meanwhile.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import fvm_core as FVM
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(FVM, "TEXTURE_STORE", str(tmp_path / "store"))
+    monkeypatch.setattr(FVM, "VTF_BACKEND", "numpy")
+    FVM.reset_output_cache()
+    return tmp_path / "store"
+
+def make_texture(seed):
+    return np.random.default_rng(seed).integers(0, 256, (16, 16, 4), dtype=np.uint8)
+
+def test_duplicates_share_one_file(tmp_path, store):
+    paths = [str(tmp_path / "out" / name) for name in ("a_c.vtf", "b_c.vtf")]
+    for path in paths:
+        FVM.export_texture(make_texture(1), path, "DXT5")
+    FVM.export_texture(make_texture(2), str(tmp_path / "out" / "c_c.vtf"), "DXT5")
+    assert os.path.samefile(*paths)
+    assert len(os.listdir(store)) == 2
+    assert FVM.clean_texture_store(str(store)) == 0
+    for path in paths:
+        os.remove(path)
+    assert FVM.clean_texture_store(str(store)) == 1
+
+def clean_before_linking(store, monkeypatch): # Another run's clean_texture_store gets in between storing a texture and linking the output to it
+    link_stored = FVM.link_stored
+    calls = []
+    def clean_first(key, path):
+        calls.append(key)
+        if len(calls) > 1: # The first call is export_texture looking for an earlier copy
+            FVM.clean_texture_store(str(store))
+        return link_stored(key, path)
+    monkeypatch.setattr(FVM, "link_stored", clean_first)
+
+def test_store_cleaned_while_linking(tmp_path, store, monkeypatch):
+    texture = make_texture(1)
+    key = FVM.get_texture_key(texture, "DXT5")
+    path = str(tmp_path / "out" / "a_c.vtf")
+    clean_before_linking(store, monkeypatch)
+    encode_texture = FVM.encode_texture
+    def store_first(*args): # Another worker stores the same texture while this one encodes it, no output links to it yet
+        data = encode_texture(*args)
+        (store / (key + ".vtf")).write_bytes(data)
+        return data
+    monkeypatch.setattr(FVM, "encode_texture", store_first)
+    with pytest.raises(RuntimeError):
+        FVM.export_texture(texture, path, "DXT5")
+    assert not os.path.exists(path)
+
+def test_own_texture_survives_cleaning(tmp_path, store, monkeypatch):
+    clean_before_linking(store, monkeypatch)
+    path = str(tmp_path / "out" / "a_c.vtf")
+    FVM.export_texture(make_texture(1), path, "DXT5")
+    assert os.stat(path).st_nlink == 2
+
+@pytest.mark.parametrize("output_path, store_path", [
+    ("mod/materials/models/props/", "mod/.fvm_textures"),
+    ("materials/", ".fvm_textures"),
+    ("out/textures/", "out/.fvm_textures"), # No materials folder
+])
+def test_store_outside_materials(tmp_path, monkeypatch, output_path, store_path):
+    monkeypatch.chdir(tmp_path)
+    settings = {"output_path": output_path, "texture_store_path": ""}
+    assert FVM.get_texture_store(settings) == str(tmp_path / store_path)
+    assert FVM.get_texture_store(dict(settings, texture_store_path="cache")) == "cache"
+
+def test_key_ignores_what_vtflib_ignores(monkeypatch):
+    texture = make_texture(1)
+    keys = {}
+    for backend in ("numpy", "vtflib"):
+        monkeypatch.setattr(FVM, "get_vtf_backend", lambda: backend)
+        for correction in (False, True):
+            monkeypatch.setattr(FVM, "MIP_CORRECTION", correction)
+            keys[backend, correction] = FVM.get_texture_key(texture, "DXT5", "coverage")
+    assert keys["numpy", False] != keys["numpy", True]
+    assert keys["vtflib", False] == keys["vtflib", True]
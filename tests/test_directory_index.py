@@ -0,0 +1,51 @@
+""" Input folder index tests
+
+Materials are found by their map suffixes in one scan of the input folder:
+a material name must never match the start of another one (rock vs rock2),
+extensions are picked in the configured order, and subfolders are only
+searched with RecursiveInput.
+"""
+
+import pytest
+
+import fvm_core as FVM
+
+SUFFIXES = ("_c", "_n", "_r")
+
+def touch(folder, *names):
+    for name in names:
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+
+def test_prefix_names(tmp_path):
+    touch(tmp_path, "rock_c.png", "rock_n.png", "rock2_c.png", "rock2_r.png", "rock_c_c.png")
+    index = FVM.DirectoryIndex(str(tmp_path), SUFFIXES, ["png"])
+    assert index.material_names("_c") == ["rock", "rock2", "rock_c"]
+    assert index.find("rock", "_n") == str(tmp_path / "rock_n.png")
+    assert index.find("rock2", "_n") is None
+    assert index.find("rock", "_r") is None
+    assert index.find("rock2", "_r") == str(tmp_path / "rock2_r.png")
+    with pytest.raises(FileNotFoundError):
+        FVM.find_texture(index, "rock2", "_n")
+
+def test_suffix_only_and_other_files(tmp_path):
+    touch(tmp_path, "_c.png", "rock_c.png.bak", "rock_c", "readme.txt", "rock_C.png")
+    index = FVM.DirectoryIndex(str(tmp_path), SUFFIXES, ["png"])
+    assert index.material_names("_c") == []
+
+def test_extension_preference(tmp_path):
+    touch(tmp_path, "rock_c.png", "rock_c.TGA", "rock_n.tga", "wood_c.jpg")
+    index = FVM.DirectoryIndex(str(tmp_path), SUFFIXES, ["TGA", "png"])
+    assert index.find("rock", "_c") == str(tmp_path / "rock_c.TGA")
+    assert index.find("rock", "_n") == str(tmp_path / "rock_n.tga")
+    assert index.material_names("_c") == ["rock"]
+    assert FVM.DirectoryIndex(str(tmp_path), SUFFIXES, ["png", "tga"]).find("rock", "_c") == str(tmp_path / "rock_c.png")
+
+def test_recursive(tmp_path):
+    touch(tmp_path, "rock_c.png", "props/crate_c.png", "props/crate_n.png", "props/metal/pipe_c.png", ".git/hidden_c.png")
+    assert FVM.DirectoryIndex(str(tmp_path), SUFFIXES, ["png"]).material_names("_c") == ["rock"]
+    index = FVM.DirectoryIndex(str(tmp_path), SUFFIXES, ["png"], recursive=True)
+    assert index.material_names("_c") == ["props/crate", "props/metal/pipe", "rock"]
+    assert index.find("props/crate", "_n") == str(tmp_path / "props" / "crate_n.png")
+    assert FVM.find_material_names(index, "props/crate", "_c") == ["props/crate"]
@@ -0,0 +1,37 @@
+""" Job server request validation
+
+Requests the worker would fail on because of their shape or their settings
+have to be rejected up front, so the client gets a 400 instead of a 500.
+"""
+
+import pytest
+
+import job_server
+
+@pytest.mark.parametrize("request_body", [
+    [],
+    {"name": 1},
+    {"name": "rock", "settings": []},
+    {"name": "rock", "textures": {"color": 1}},
+    {"name": "rock", "outputs": "diffuse"},
+    {"name": "rock", "write": "yes"},
+    {"name": "rock", "settings": {"midtone": "abc"}},
+    {"name": "rock", "settings": {"midtone": 256}},
+    {"name": "rock", "settings": {"force_compression": 1}},
+    {"name": "rock", "settings": {"tile_budget": 1.5}},
+    {"name": "rock", "settings": {"mip_filter": "bicubic"}},
+    {"name": "rock", "settings": {"vtf_backend": "vtflib2"}},
+    {"name": "rock", "settings": {"suffixes": {"color": None}}},
+    {"name": "rock", "settings": {"outptu_path": "materials/"}},
+])
+def test_bad_requests(request_body):
+    with pytest.raises(ValueError):
+        job_server.check_request(request_body)
+
+@pytest.mark.parametrize("request_body", [
+    {"name": "rock"},
+    {"name": "rock", "textures": {"color": "rock_c.png", "ao": None}, "outputs": ["diffuse"], "write": False},
+    {"name": "rock", "settings": {"midtone": "235", "metallic_factor": 1, "mip_filter": "kaiser", "output_path": "materials/x/"}},
+])
+def test_good_requests(request_body):
+    job_server.check_request(request_body)
@@ -0,0 +1,29 @@
+""" Output writing tests
+
+Outputs are written to a unique temporary file that then replaces the
+output, and end up with the mode a normally created file would get, or the
+mode of the file they replace.
+"""
+
+import os
+
+import fvm_core as FVM
+
+def test_umask_read_without_changing_it(monkeypatch):
+    if not os.path.exists("/proc/self/status"):
+        return
+    monkeypatch.setattr(os, "umask", None) # Calling it would fail
+    umask = FVM.read_umask()
+    assert FVM.FILE_MODE == 0o666 & ~umask
+
+def test_new_and_replaced_modes(tmp_path):
+    FVM.reset_output_cache()
+    path = str(tmp_path / "out" / "rock.vmt")
+    FVM.write_output(path, "first")
+    assert os.stat(path).st_mode & 0o7777 == FVM.FILE_MODE
+    os.chmod(path, 0o640)
+    FVM.write_output(path, b"second")
+    assert os.stat(path).st_mode & 0o7777 == 0o640
+    with open(path, 'rb') as f:
+        assert f.read() == b"second"
+    assert os.listdir(tmp_path / "out") == ["rock.vmt"]
@@ -0,0 +1,118 @@
+""" Regression tests for the numpy packing functions
+
+pack_diffuse and pack_exponent replaced a chain of PIL convert, blend,
+multiply and merge calls, apply_gamma replaced a per-pixel loop over
+do_gamma. The old code is kept here as the reference and both are run on
+random inputs in every mode a source map can have.
+"""
+
+import math
+
+import numpy as np
+import pytest
+from PIL import Image, ImageChops
+
+import fvm_core as FVM
+
+SIZE = (37, 23) # Odd sizes, so nothing lines up with the packing chunks or DXT blocks
+MODES = ("RGB", "RGBA", "L")
+METALLIC_FACTOR = 210/255*0.83
+
+def random_image(mode, seed):
+    rng = np.random.default_rng(seed)
+    channels = len(mode)
+    data = rng.integers(0, 256, (SIZE[1], SIZE[0], channels), dtype=np.uint8)
+    return Image.fromarray(data[..., 0] if channels == 1 else data, mode)
+
+def old_diffuse(cIm, aoIm, mIm, gIm, metallic_factor): # do_diffuse before the numpy version, without the export
+    final_diffuse = cIm.convert("RGBA")
+    if aoIm != None:
+        final_diffuse = ImageChops.multiply(final_diffuse.convert("RGB"), aoIm.convert("RGB")).convert("RGBA")
+    else:
+        final_diffuse = ImageChops.blend(final_diffuse.convert("RGB"), ImageChops.multiply(final_diffuse.convert("RGB"), gIm.convert("RGB")), 0.3).convert("RGBA")
+    r,g,b,a = final_diffuse.split()
+    a = Image.blend(cIm.convert("L"), mIm.convert("L"), metallic_factor)
+    a = a.convert("L")
+    return np.asarray(Image.merge("RGBA", (r,g,b,a)))
+
+def old_exponent(gIm, clear_exponent): # do_exponent before the numpy version, without the export
+    finalExponent = gIm.convert("RGBA")
+    r,g,b,a = finalExponent.split()
+    layerImage = Image.new('RGBA', finalExponent.size, (0, 217, 0, 100))
+    blackImage = Image.new('RGBA', finalExponent.size, (0, 0, 0, 100))
+    g = Image.blend(g.convert('RGBA'), layerImage, 1).convert('L')
+    b = Image.blend(b.convert('RGBA'), blackImage, 1).convert('L')
+    if clear_exponent:
+        g = Image.new('L', finalExponent.size, 255)
+    return np.asarray(Image.merge('RGBA', (r,g,b,a)))
+
+def do_gamma(x, y, im, mt): # Change the gamma of the given channels of "im" at a given xy coordinate to "config_midtone", similar to how photoshop does it
+    gamma = 1
+    midToneNormal = mt / 255
+    if mt < 128:
+        midToneNormal = midToneNormal * 2
+        gamma = 1 + (9*(1-midToneNormal))
+        gamma = min(gamma, 9.99)
+    elif mt > 128:
+        midToneNormal = (midToneNormal * 2) - 1
+        gamma = 1 - midToneNormal
+        gamma = max(gamma, 0.01)
+
+    gamma_correction = 1/gamma
+    (r,g,b,a) = im.getpixel((x,y))
+    if mt != 128:
+        r = 255 * ( pow( ( r / 255 ), gamma_correction ) )
+        g = 255 * ( pow( ( g / 255 ), gamma_correction ) )
+        b = 255 * ( pow( ( b / 255 ), gamma_correction ) )
+    r = math.ceil(r)
+    g = math.ceil(g)
+    b = math.ceil(b)
+    return (r,g,b,a)
+
+def old_gamma(gIm, midtone): # The loop of do_normal before the lookup table, it skipped the first row and column
+    finalGloss = gIm.convert('RGBA')
+    for x in range(1, finalGloss.size[0]):
+        for y in range(1, finalGloss.size[1]):
+            finalGloss.putpixel((x,y), do_gamma(x, y, finalGloss, midtone))
+    return np.asarray(finalGloss)
+
+def assert_within_one(new, old):
+    assert new.shape == old.shape
+    assert np.abs(new.astype(np.int16) - old.astype(np.int16)).max() <= 1
+
+@pytest.mark.parametrize("color_mode", MODES)
+@pytest.mark.parametrize("other_mode", MODES)
+@pytest.mark.parametrize("with_ao", [True, False])
+def test_pack_diffuse(color_mode, other_mode, with_ao):
+    color = random_image(color_mode, 1)
+    ao = random_image(other_mode, 2) if with_ao else None
+    metal = random_image(other_mode, 3)
+    gloss = random_image(other_mode, 4)
+    new = FVM.pack_diffuse(np.asarray(color.convert("RGB")), np.asarray(ao.convert("RGB")) if with_ao else None,
+                           np.asarray(gloss.convert("RGB")), np.asarray(metal.convert("L")), METALLIC_FACTOR)
+    assert_within_one(new, old_diffuse(color, ao, metal, gloss, METALLIC_FACTOR))
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("clear_exponent", [True, False])
+def test_pack_exponent(mode, clear_exponent):
+    gloss = random_image(mode, 5)
+    new = FVM.pack_exponent(np.asarray(gloss.convert("RGBA")), clear_exponent)
+    assert_within_one(new, old_exponent(gloss, clear_exponent))
+
+def test_pack_diffuse_chunks(monkeypatch): # Images taller than one chunk of rows give the same result
+    color, ao, metal = random_image("RGB", 6), random_image("RGB", 7), random_image("L", 8)
+    arrays = (np.asarray(color), np.asarray(ao), None, np.asarray(metal), METALLIC_FACTOR)
+    whole = FVM.pack_diffuse(*arrays)
+    monkeypatch.setattr(FVM, "CHUNK_PIXELS", SIZE[0] * 2)
+    np.testing.assert_array_equal(FVM.pack_diffuse(*arrays), whole)
+
+@pytest.mark.parametrize("midtone", [0, 50, 127, 128, 129, 235, 255])
+def test_apply_gamma(midtone): # The lookup table has to reproduce the old float math exactly
+    gloss = random_image("RGBA", 9)
+    np.testing.assert_array_equal(FVM.apply_gamma(np.asarray(gloss), midtone), old_gamma(gloss, midtone))
+
+def test_apply_gamma_tiles(): # Tiles after the first one don't skip their first row, only the image's first row is skipped
+    gloss = np.asarray(random_image("RGB", 10))
+    whole = FVM.apply_gamma(gloss, 235)
+    tiles = [FVM.apply_gamma(gloss[rows], 235, first_row=rows.start) for rows in FVM.row_slices(SIZE[1], 4)]
+    np.testing.assert_array_equal(np.concatenate(tiles), whole)
@@ -0,0 +1,35 @@
+""" VTF inspection and downscaling tests
+
+Downscaled textures are reported as they were written, with the mips the
+re-encode added, not with the header they had before.
+"""
+
+import numpy as np
+import pytest
+
+import resize
+import vtf_writer
+
+def save_vtf(path, width, height, vtf_format, flags=0, mips=False):
+    image_data = np.random.default_rng(1).integers(0, 256, (height, width, 4), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(vtf_writer.write_vtf(image_data, vtf_format, flags, resize=False, mipmaps=None if mips else [image_data]))
+    return str(path)
+
+@pytest.mark.parametrize("flags, mipmap_count", [(0, 9), (resize.FLAG_NOMIP, 1)])
+def test_downscale_reports_new_header(tmp_path, flags, mipmap_count):
+    path = save_vtf(tmp_path / "a.vtf", 200, 300, vtf_writer.IMAGE_FORMAT_RGBA8888, flags)
+    entries = resize.inspect_files([path], 4096)
+    assert "not_power_of_two" in entries[0]["issues"]
+    assert resize.downscale_files(entries, 4096) == 1
+    assert (entries[0]["width"], entries[0]["height"], entries[0]["mipmap_count"]) == (256, 256, mipmap_count)
+    assert entries[0]["issues"] == []
+    assert entries[0]["downscaled_from"] == [200, 300]
+
+def test_oversized_drops_mips(tmp_path):
+    path = save_vtf(tmp_path / "a.vtf", 64, 32, vtf_writer.IMAGE_FORMAT_DXT1, mips=True)
+    entries = resize.inspect_files([path], 16)
+    assert entries[0]["issues"] == ["oversized"]
+    resize.downscale_files(entries, 16)
+    assert (entries[0]["width"], entries[0]["height"], entries[0]["mipmap_count"]) == (16, 8, 5)
+    assert entries[0]["issues"] == []
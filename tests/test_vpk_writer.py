@@ -0,0 +1,95 @@
+""" VPK writer tests
+
+Archives are read back with read_directory and read_file: every file has to
+come back under its path, at the offset and in the chunk the directory
+says, with a matching CRC.
+"""
+
+import os
+import struct
+import zlib
+
+import pytest
+
+import vpk_writer
+
+FILES = {
+    "materials/test/rock_c.vtf": b"rock color" * 40,
+    "materials/test/rock_n.vtf": b"rock normal" * 30,
+    "materials/test/rock.vmt": b'"VertexLitGeneric"\n{\n}',
+    "materials/test/sub/wood_c.vtf": b"wood color" * 50,
+    "materials/Test/Upper.VMT": b"upper case",
+    "materials/test/no_extension": b"plain",
+    "root.txt": b"no folder",
+}
+
+def write_archive(path, files, chunk_size=0, dedup=False):
+    writer = vpk_writer.VPKWriter(str(path), chunk_size, dedup)
+    for name, data in files.items():
+        writer.add(name, data)
+    return writer.close()
+
+def check_archive(dir_path, files):
+    entries, data_offset = vpk_writer.read_directory(dir_path)
+    assert sorted(entries) == sorted(name.lower() for name in files)
+    for name, data in files.items():
+        crc, _, _, length = entries[name.lower()]
+        assert (crc, length) == (zlib.crc32(data), len(data))
+        assert vpk_writer.read_file(dir_path, name) == data
+    return entries, data_offset
+
+def test_single_file(tmp_path):
+    paths = write_archive(tmp_path / "pak01.vpk", FILES)
+    assert paths == [str(tmp_path / "pak01.vpk")]
+    entries, data_offset = check_archive(paths[0], FILES)
+    with open(paths[0], 'rb') as f:
+        signature, version, tree_size = struct.unpack("<III", f.read(12))
+        content = f.read()
+    assert (signature, version, data_offset) == (vpk_writer.VPK_SIGNATURE, 1, 12 + tree_size)
+    offset = 0
+    for name, data in FILES.items(): # Embedded data follows the tree, in the order the files were added
+        assert entries[name.lower()][1:3] == (vpk_writer.EMBEDDED_ARCHIVE, offset)
+        offset += len(data)
+    assert len(content) == tree_size + offset
+
+def test_chunked(tmp_path):
+    paths = write_archive(tmp_path / "pak01.vpk", FILES, chunk_size=600)
+    assert paths[0] == str(tmp_path / "pak01_dir.vpk")
+    assert paths[1:] == [str(tmp_path / f"pak01_{index:03d}.vpk") for index in range(len(paths) - 1)]
+    assert len(paths) > 2
+    entries, _ = check_archive(paths[0], FILES)
+    for path in paths[1:]:
+        assert os.path.getsize(path) <= 600
+    for crc, archive_index, offset, length in entries.values():
+        assert archive_index != vpk_writer.EMBEDDED_ARCHIVE
+        assert offset + length <= os.path.getsize(paths[1 + archive_index])
+
+def test_chunked_removes_old_chunks(tmp_path):
+    old_paths = write_archive(tmp_path / "pak01_dir.vpk", FILES, chunk_size=200)
+    paths = write_archive(tmp_path / "pak01_dir.vpk", FILES, chunk_size=2000)
+    assert len(paths) < len(old_paths)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths)
+    check_archive(paths[0], FILES)
+
+@pytest.mark.parametrize("chunk_size", [0, 600])
+def test_dedup(tmp_path, chunk_size):
+    files = dict(FILES)
+    files["materials/test/rock2_n.vtf"] = files["materials/test/rock_n.vtf"]
+    files["materials/other/rock_n.vtf"] = files["materials/test/rock_n.vtf"]
+    paths = write_archive(tmp_path / "pak01.vpk", files, chunk_size, dedup=True)
+    entries, _ = check_archive(paths[0], files)
+    shared = {entries[name][1:] for name in ("materials/test/rock_n.vtf", "materials/test/rock2_n.vtf", "materials/other/rock_n.vtf")}
+    assert len(shared) == 1 # Same chunk, offset and length
+    undeduplicated = write_archive(tmp_path / "full" / "pak01.vpk", files, chunk_size)
+    stored = sum(os.path.getsize(path) for path in paths)
+    assert sum(os.path.getsize(path) for path in undeduplicated) - stored == 2 * len(files["materials/test/rock_n.vtf"])
+
+def test_first_file_wins(tmp_path):
+    paths = write_archive(tmp_path / "pak01.vpk", {"materials/a.vmt": b"first"})
+    writer = vpk_writer.VPKWriter(str(tmp_path / "pak02.vpk"))
+    writer.add("materials/a.vmt", b"first")
+    writer.add("MATERIALS\\A.vmt", b"second")
+    assert "materials/a.vmt" in writer
+    dir_path = writer.close()[0]
+    assert vpk_writer.read_file(dir_path, "materials/a.vmt") == b"first"
+    assert os.path.getsize(dir_path) == os.path.getsize(paths[0])
@@ -0,0 +1,130 @@
+""" Round trip tests for the built-in VTF encoder
+
+Every texture is written with write_vtf, read back and compared with the
+source. DXT blocks are also decoded through PIL's BC1/BC3 decoder, which
+shares no code with vtf_writer's own decoders.
+"""
+
+import io
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import vtf_writer
+import resample
+
+FORMATS = { # (format, (mean error, max error) after decoding)
+    "RGBA8888": (vtf_writer.IMAGE_FORMAT_RGBA8888, (0, 0)),
+    "DXT1": (vtf_writer.IMAGE_FORMAT_DXT1, (5, 24)),
+    "DXT5": (vtf_writer.IMAGE_FORMAT_DXT5, (5, 24)),
+}
+DXT_CHECKED_SIZE = 32 # Below this a 4x4 block spans most of the gradient, which four palette colors can't follow
+DDS_FOURCC = {vtf_writer.IMAGE_FORMAT_DXT1: b"DXT1", vtf_writer.IMAGE_FORMAT_DXT5: b"DXT5"}
+
+def make_image(width, height, seed=0): # Smooth gradients with a little noise, which DXT can represent well
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack((x / width * 255, y / height * 255, (x + y) / (width + height) * 255, 255 - x / width * 255), axis=-1)
+    image += rng.normal(0, 2, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def to_dds(data, width, height, vtf_format): # Wrap BC1/BC3 blocks into a minimal DDS file
+    header = struct.pack("<4s7I44x8I5I", b"DDS ", 124, 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000, height, width, len(data), 0, 0,
+                         32, 0x4, int.from_bytes(DDS_FOURCC[vtf_format], "little"), 0, 0, 0, 0, 0,
+                         0x1000, 0, 0, 0, 0)
+    return header + data
+
+def decode_with_pil(data, width, height, vtf_format):
+    with Image.open(io.BytesIO(to_dds(data, width, height, vtf_format))) as image:
+        return np.asarray(image.convert("RGBA"))
+
+def get_levels(data): # Raw bytes of every mip level, largest first
+    header = vtf_writer.read_vtf_header(data)
+    offset = header["header_size"] + vtf_writer.get_image_size(header["thumbnail_width"], header["thumbnail_height"], header["thumbnail_format"])
+    levels = []
+    for level in reversed(range(header["mipmap_count"])):
+        width, height = max(1, header["width"] >> level), max(1, header["height"] >> level)
+        size = vtf_writer.get_image_size(width, height, header["format"])
+        levels.append((data[offset:offset + size], width, height))
+        offset += size
+    assert offset == len(data)
+    return levels[::-1]
+
+def assert_close(decoded, source, tolerance, channels=4):
+    mean_error, max_error = tolerance
+    error = np.abs(decoded[..., :channels].astype(np.int16) - source[..., :channels].astype(np.int16))
+    assert error.mean() <= mean_error
+    assert error.max() <= max_error
+
+@pytest.mark.parametrize("name", FORMATS)
+@pytest.mark.parametrize("size", [(64, 64), (128, 32), (8, 2)])
+def test_header(name, size):
+    vtf_format, _ = FORMATS[name]
+    width, height = size
+    data = vtf_writer.write_vtf(make_image(width, height), vtf_format, vtf_writer.FLAG_EIGHTBITALPHA)
+    header = vtf_writer.read_vtf_header(data)
+    assert header["version"] == vtf_writer.VTF_VERSION
+    assert header["header_size"] == vtf_writer.HEADER_SIZE
+    assert (header["width"], header["height"]) == size
+    assert header["format"] == vtf_format
+    assert header["flags"] == vtf_writer.FLAG_EIGHTBITALPHA
+    assert header["frames"] == 1 and header["depth"] == 1
+    assert header["mipmap_count"] == vtf_writer.get_mipmap_count(width, height)
+    assert header["thumbnail_format"] == vtf_writer.IMAGE_FORMAT_DXT1
+    assert max(header["thumbnail_width"], header["thumbnail_height"]) <= vtf_writer.THUMBNAIL_SIZE
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_mipmap_sizes(name):
+    vtf_format, _ = FORMATS[name]
+    data = vtf_writer.write_vtf(make_image(256, 64), vtf_format)
+    levels = get_levels(data)
+    assert len(levels) == 9 # 256x64 down to 1x1
+    assert [(width, height) for _, width, height in levels] == [(max(1, 256 >> level), max(1, 64 >> level)) for level in range(9)]
+    for level_data, width, height in levels:
+        assert len(level_data) == vtf_writer.get_image_size(width, height, vtf_format)
+
+@pytest.mark.parametrize("name", FORMATS)
+def test_round_trip(name):
+    vtf_format, tolerance = FORMATS[name]
+    source = make_image(128, 128)
+    header, mipmaps = vtf_writer.read_vtf(vtf_writer.write_vtf(source, vtf_format))
+    expected = resample.generate_mipmaps(source)
+    assert len(mipmaps) == len(expected) == header["mipmap_count"]
+    channels = 3 if vtf_format == vtf_writer.IMAGE_FORMAT_DXT1 else 4 # DXT1 has no alpha here
+    for decoded, level in zip(mipmaps, expected):
+        assert decoded.shape == level.shape
+        if vtf_format == vtf_writer.IMAGE_FORMAT_RGBA8888 or min(level.shape[:2]) >= DXT_CHECKED_SIZE:
+            assert_close(decoded, level, tolerance, channels)
+
+@pytest.mark.parametrize("name", ["DXT1", "DXT5"])
+def test_pil_decoder(name): # The blocks have to decode the same in an independent BCn decoder
+    vtf_format, tolerance = FORMATS[name]
+    source = make_image(64, 32, seed=1)
+    data = vtf_writer.write_vtf(source, vtf_format)
+    _, ours = vtf_writer.read_vtf(data)
+    for (level_data, width, height), decoded in zip(get_levels(data), ours):
+        if width < 4 or height < 4: # Pillow's DDS plugin wants whole blocks
+            continue
+        theirs = decode_with_pil(level_data, width, height, vtf_format)
+        channels = 3 if vtf_format == vtf_writer.IMAGE_FORMAT_DXT1 else 4
+        assert np.abs(theirs[..., :channels].astype(np.int16) - decoded[..., :channels]).max() <= 1 # Decoders may round the interpolated colors differently
+    assert_close(decode_with_pil(get_levels(data)[0][0], 64, 32, vtf_format), source, tolerance, 3 if vtf_format == vtf_writer.IMAGE_FORMAT_DXT1 else 4)
+
+def test_dxt1_solid_blocks(): # Flat colors that are exact in RGB565 come back unchanged
+    source = np.zeros((8, 8, 4), dtype=np.uint8)
+    source[..., :3] = (255, 0, 255)
+    source[4:, :, :3] = (0, 255, 0)
+    source[..., 3] = 255
+    data = vtf_writer.encode_dxt1(source)
+    assert len(data) == vtf_writer.get_image_size(8, 8, vtf_writer.IMAGE_FORMAT_DXT1)
+    np.testing.assert_array_equal(decode_with_pil(data, 8, 8, vtf_writer.IMAGE_FORMAT_DXT1), source)
+
+def test_single_level(): # NOMIP textures only have their full size level, the thumbnail is still generated
+    source = make_image(64, 32)
+    data = vtf_writer.write_vtf(source, vtf_writer.IMAGE_FORMAT_DXT5, 0x100, mipmaps=[source])
+    header, mipmaps = vtf_writer.read_vtf(data)
+    assert header["mipmap_count"] == 1
+    assert (header["thumbnail_width"], header["thumbnail_height"]) == (16, 8)
+    assert len(mipmaps) == 1 and mipmaps[0].shape == source.shape
@@ -0,0 +1,155 @@
+""" VMT templates for FastValveMaterial
+
+Materials are rendered from text templates with {{field}} placeholders. A
+field on a line of its own is a block: every line of its value gets the
+field's indentation, and the whole line is dropped if the value is empty,
+which is how the optional proxies end up in the material. Templates are
+compiled once and then only joined with the values, until one of the files
+in the template folder changes. load_templates checks the folder, callers
+load the templates once per run and hand them to the other functions.
+
+Every "<name>.vmt" file in the template folder (TemplatePath in the config)
+replaces the built-in template of the same name or adds a new one, which
+MaterialTemplate can then select. The fields are:
+    version, name, path      FVM version, material name, texture path in the game
+    metalness, midtone       The Metalness and GammaAdjustment settings as in the VMT comment
+    phong                    The "phongwarp" or the "fresnel" template, depending on UsePhongwarps
+    proxies                  The "proxies" template with UseMaterialProxies, empty otherwise
+"""
+
+import os
+import re
+import hashlib
+
+FIELD = re.compile(r"^(?P<indent>[ \t]*)\{\{\s*(?P<block>\w+)\s*\}\}[ \t]*(?:\n|\Z)|\{\{\s*(?P<inline>\w+)\s*\}\}", re.MULTILINE)
+
+BUILTIN_TEMPLATES = {
+    "pbr": ('// Generated by FastValveMaterial v{{version}}\n'
+            '// METALNESS: {{metalness}} GAMMA: {{midtone}}\n'
+            '"VertexLitGeneric"\n'
+            '{\n'
+            '\t"$basetexture" "{{path}}{{name}}_c"\n'
+            '\t"$bumpmap" "{{path}}{{name}}_n"\n'
+            '\t"$phongexponenttexture" "{{path}}{{name}}_m"\n'
+            '\t"$color2" "[ .1 .1 .1 ]"\n'
+            '\t"$blendtintbybasealpha" "1"\n'
+            '\t"$phong" "1"\n'
+            '\t"$phongboost" "10"\n'
+            '\t"$phongalbedotint" "1"\n'
+            '\t{{phong}}\n'
+            '\t"$envmap" "env_cubemap"\n'
+            '\t"$basemapalphaenvmapmask" "1"\n'
+            '\t"$envmapfresnel" "0.4"\n'
+            '\t"$envmaptint" "[ .1 .1 .1 ]"\n'
+            '\t{{proxies}}\n'
+            '}'),
+    "normalized": ('// Generated by FastValveMaterial v{{version}}\n' # Additive pass for mesh stacking, see EmptyGreenOnExponentMap
+                   '// NORMALIZED MATERIAL!\n'
+                   '"VertexLitGeneric"\n'
+                   '{\n'
+                   '\t"$basetexture" "{{path}}{{name}}_c"\n'
+                   '\t"$bumpmap" "{{path}}{{name}}_n"\n'
+                   '\t"$phongexponenttexture" "{{path}}{{name}}_m"\n'
+                   '\t"$phong" "1"\n'
+                   '\t"$phongboost" "1"\n'
+                   '\t"$color2" "[ 0 0 0 ]"\n'
+                   '\t"$phongexponent"    "24"\n'
+                   '\t"$phongalbedotint" "1"\n'
+                   '\t"$additive"    "1"\n'
+                   '\t"$PhongFresnelRanges" "[ 2 4 6 ]"\n'
+                   '\t{{proxies}}\n'
+                   '}'),
+    "phongwarp": '"$phongwarptexture" "{{path}}phongwarp_steel"',
+    "fresnel": '"$PhongFresnelRanges" "[ 4 3 10 ]"',
+    "proxies": ('"Proxies"\n'
+                '{\n'
+                '\t"MwEnvMapTint"\n'
+                '\t{\n'
+                '\t\t"min" "0"\n'
+                '\t\t"max" "0.015"\n'
+                '\t}\n'
+                '}'),
+}
+TEMPLATE_CACHE = {} # Template folder -> (get_folder_state, {name: Template})
+
+class Template:
+    def __init__(self, text, name="template"):
+        self.text = text
+        self.name = name
+        self.parts = [] # Literal strings and (field, indent, newline) tuples, the indent is None for inline fields
+        position = 0
+        for match in FIELD.finditer(text):
+            self.parts.append(text[position:match.start()])
+            if match["block"]:
+                self.parts.append((match["block"], match["indent"], match.group().endswith("\n")))
+            else:
+                self.parts.append((match["inline"], None, False))
+            position = match.end()
+        self.parts.append(text[position:])
+        self.fields = {part[0] for part in self.parts if isinstance(part, tuple)}
+
+    def render(self, values):
+        result = []
+        for part in self.parts:
+            if isinstance(part, str):
+                result.append(part)
+                continue
+            field, indent, newline = part
+            if field not in values:
+                raise ValueError(f"Unknown field '{field}' in template '{self.name}', use one of {', '.join(sorted(values))}")
+            value = str(values[field])
+            if indent is None:
+                result.append(value)
+            elif value:
+                result.append("\n".join(indent + line for line in value.split("\n")) + ("\n" if newline else ""))
+        return "".join(result)
+
+def get_folder_state(folder): # (file name, size, modification time) of every template in "folder", changes whenever one is edited, added or removed
+    if not folder:
+        return ()
+    state = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() == ".vmt":
+                stat = entry.stat()
+                state.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(state))
+
+def load_templates(folder=""): # The compiled built-in templates, replaced or extended by the "<name>.vmt" files in "folder"
+    # Compiled again whenever the folder changes, so watch mode and the job server pick up edited templates
+    state = get_folder_state(folder)
+    cached = TEMPLATE_CACHE.get(folder)
+    if cached is None or cached[0] != state:
+        texts = dict(BUILTIN_TEMPLATES)
+        for file_name, _, _ in state:
+            with open(os.path.join(folder, file_name), 'r') as f:
+                texts[os.path.splitext(file_name)[0]] = f.read().rstrip("\n") # A final newline would otherwise end up in the middle of the material for blocks
+        cached = TEMPLATE_CACHE[folder] = (state, {name: Template(text, name) for name, text in texts.items()})
+    return cached[1]
+
+def get_templates_hash(templates): # Changes whenever one of the templates does, so the rebuild manifest notices edited user templates
+    templates_hash = hashlib.blake2b(digest_size=16)
+    for name, template in sorted(templates.items()):
+        templates_hash.update(f"{name}\0{template.text}\0".encode())
+    return templates_hash.hexdigest()
+
+def get_template(settings, templates): # The template the materials of these settings use, out of the templates load_templates returned
+    name = settings["material_template"] or ("normalized" if settings["clear_exponent"] else "pbr")
+    if name not in templates:
+        raise ValueError(f"Unknown material template '{name}', use one of {', '.join(sorted(templates))}")
+    return templates[name]
+
+def uses_phongwarp(settings, templates): # Whether the material references the phongwarp texture, which then has to be copied next to it
+    return settings["phongwarps"] and "phong" in get_template(settings, templates).fields
+
+def render_material(name, settings, path, version, templates): # VMT text of a material, "path" is the folder of its textures inside "materials"
+    values = {
+        "version": version,
+        "name": name,
+        "path": path,
+        "metalness": int(settings["metallic_factor"] * 255),
+        "midtone": settings["midtone"],
+    }
+    values["phong"] = templates["phongwarp" if settings["phongwarps"] else "fresnel"].render(values)
+    values["proxies"] = templates["proxies"].render(values) if settings["material_proxies"] else ""
+    return get_template(settings, templates).render(values)
@@ -0,0 +1,173 @@
+""" Minimal VPK (version 1) archive writer for FastValveMaterial
+
+Files are added one at a time and their data is written out right away, either
+into numbered chunk archives (name_000.vpk, name_001.vpk, ...) next to a
+name_dir.vpk directory file, or, for single file archives, into a temporary
+file that gets appended to the directory tree when the archive is closed.
+With "dedup", files with the same contents are stored once and their
+directory entries point at the same data.
+"""
+
+import os
+import hashlib
+import shutil
+import struct
+import tempfile
+import zlib
+
+VPK_SIGNATURE = 0x55aa1234
+VPK_VERSION = 1
+HEADER_SIZE = 12
+EMBEDDED_ARCHIVE = 0x7fff # Archive index of data stored in the directory file itself
+ENTRY_TERMINATOR = 0xffff
+
+def split_path(path): # "materials/test/rock_c.vtf" to ("materials/test", "rock_c", "vtf"), VPKs use a space for empty parts
+    path = path.replace("\\", "/").strip("/").lower() # Source looks files up case insensitively, lowercase paths always match
+    folder, _, file_name = path.rpartition("/")
+    stem, dot, extension = file_name.rpartition(".")
+    if not dot:
+        stem, extension = file_name, ""
+    return folder or " ", stem or " ", extension or " "
+
+def get_archive_paths(path, chunked): # (directory file, chunk file pattern) for an archive path like "pak01.vpk" or "pak01_dir.vpk"
+    base = path[:-len(".vpk")] if path.lower().endswith(".vpk") else path
+    if not chunked:
+        return base + ".vpk", None
+    if base.lower().endswith("_dir"):
+        base = base[:-len("_dir")]
+    return base + "_dir.vpk", base + "_{:03d}.vpk"
+
+class VPKWriter:
+    def __init__(self, path, chunk_size=0, dedup=False): # "chunk_size" in bytes, 0 writes a single file archive
+        self.chunk_size = chunk_size
+        self.shared = {} if dedup else None # Content hash -> (archive index, offset) of data that was already written
+        self.dir_path, self.chunk_pattern = get_archive_paths(path, chunk_size > 0)
+        self.entries = {} # (extension, folder, name) -> (crc, archive index, offset, length)
+        self.chunk_paths = []
+        self.chunk = None
+        self.chunk_index = -1
+        os.makedirs(os.path.dirname(self.dir_path) or ".", exist_ok=True)
+        if not chunk_size:
+            self.data = tempfile.TemporaryFile()
+
+    def next_chunk(self):
+        if self.chunk is not None:
+            self.chunk.close()
+        self.chunk_index += 1
+        path = self.chunk_pattern.format(self.chunk_index)
+        self.chunk_paths.append(path)
+        self.chunk = open(path + ".tmp", 'wb') # Renamed once the archive is complete
+        return self.chunk
+
+    def __contains__(self, path):
+        folder, name, extension = split_path(path)
+        return (extension, folder, name) in self.entries
+
+    def add(self, path, data): # Add a file, later files with the same path are ignored
+        folder, name, extension = split_path(path)
+        key = (extension, folder, name)
+        if key in self.entries:
+            return
+        digest = None
+        if self.shared is not None:
+            digest = hashlib.blake2b(data, digest_size=16).digest()
+            if digest in self.shared:
+                archive_index, offset = self.shared[digest]
+                self.entries[key] = (zlib.crc32(data), archive_index, offset, len(data))
+                return
+        if self.chunk_size:
+            f = self.chunk
+            if f is None or (f.tell() and f.tell() + len(data) > self.chunk_size): # A file bigger than a chunk gets a chunk of its own
+                f = self.next_chunk()
+            archive_index = self.chunk_index
+        else:
+            f = self.data
+            archive_index = EMBEDDED_ARCHIVE
+        offset = f.tell()
+        f.write(data)
+        self.entries[key] = (zlib.crc32(data), archive_index, offset, len(data))
+        if digest is not None:
+            self.shared[digest] = (archive_index, offset)
+
+    def build_tree(self): # Extensions, then folders, then file names, each list ends with an empty string
+        tree = bytearray()
+        extensions = {}
+        for (extension, folder, name), entry in self.entries.items():
+            extensions.setdefault(extension, {}).setdefault(folder, {})[name] = entry
+        for extension in sorted(extensions):
+            tree += extension.encode() + b"\0"
+            for folder in sorted(extensions[extension]):
+                tree += folder.encode() + b"\0"
+                for name, (crc, archive_index, offset, length) in sorted(extensions[extension][folder].items()):
+                    tree += name.encode() + b"\0"
+                    tree += struct.pack("<IHHIIH", crc, 0, archive_index, offset, length, ENTRY_TERMINATOR)
+                tree += b"\0"
+            tree += b"\0"
+        tree += b"\0"
+        return bytes(tree)
+
+    def close(self): # Write the directory file and move the chunks into place
+        tree = self.build_tree()
+        if self.chunk is not None:
+            self.chunk.close()
+        with open(self.dir_path + ".tmp", 'wb') as f:
+            f.write(struct.pack("<III", VPK_SIGNATURE, VPK_VERSION, len(tree)))
+            f.write(tree)
+            if not self.chunk_size:
+                self.data.seek(0)
+                shutil.copyfileobj(self.data, f)
+                self.data.close()
+        for path in self.chunk_paths:
+            os.replace(path + ".tmp", path)
+        os.replace(self.dir_path + ".tmp", self.dir_path)
+        index = len(self.chunk_paths)
+        while self.chunk_pattern and os.path.exists(self.chunk_pattern.format(index)): # Chunks of an older, bigger version of the archive
+            os.remove(self.chunk_pattern.format(index))
+            index += 1
+        return [self.dir_path] + self.chunk_paths
+
+def read_directory(dir_path): # {path: (crc, archive index, offset, length)} of a VPK directory file, plus the offset of embedded data
+    with open(dir_path, 'rb') as f:
+        signature, version, tree_size = struct.unpack("<III", f.read(HEADER_SIZE))
+        if signature != VPK_SIGNATURE or version != VPK_VERSION:
+            raise ValueError(f"'{dir_path}' is not a version 1 VPK")
+        tree = f.read(tree_size)
+    entries = {}
+    position = 0
+    def read_string():
+        nonlocal position
+        end = tree.index(b"\0", position)
+        string = tree[position:end].decode()
+        position = end + 1
+        return string
+    while True:
+        extension = read_string()
+        if not extension:
+            break
+        while True:
+            folder = read_string()
+            if not folder:
+                break
+            while True:
+                name = read_string()
+                if not name:
+                    break
+                crc, preload, archive_index, offset, length, terminator = struct.unpack_from("<IHHIIH", tree, position)
+                position += 18 + preload
+                path = "/".join(part for part in (folder.strip(), name.strip()) if part)
+                entries[path + ("." + extension if extension.strip() else "")] = (crc, archive_index, offset, length)
+    return entries, HEADER_SIZE + tree_size
+
+def read_file(dir_path, path): # Data of a single file in the archive, checked against its CRC
+    entries, data_offset = read_directory(dir_path)
+    crc, archive_index, offset, length = entries[path.lower()]
+    if archive_index == EMBEDDED_ARCHIVE:
+        archive_path, offset = dir_path, offset + data_offset
+    else:
+        archive_path = dir_path[:-len("_dir.vpk")] + f"_{archive_index:03d}.vpk"
+    with open(archive_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    if zlib.crc32(data) != crc:
+        raise ValueError(f"CRC mismatch for '{path}' in '{dir_path}'")
+    return data
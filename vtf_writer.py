@@ -0,0 +1,364 @@
+""" Built-in VTF 7.2 encoder for FastValveMaterial
+
+Writes RGBA8888, DXT1 and DXT5 textures (with mipmaps and a DXT1 thumbnail)
+straight from numpy arrays, so no native VTFLib is needed. Also contains the
+matching header reader and DXT decoders, which are used to check the output.
+"""
+
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+try:
+    import resample
+except ImportError:
+    from . import resample
+
+# Values match VTFLibEnums.ImageFormat / VTFLibEnums.ImageFlag
+IMAGE_FORMAT_RGBA8888 = 0
+IMAGE_FORMAT_DXT1 = 13
+IMAGE_FORMAT_DXT5 = 15
+IMAGE_FORMAT_NONE = -1
+
+FLAG_NORMAL = 0x00000080
+FLAG_ONEBITALPHA = 0x00001000
+FLAG_EIGHTBITALPHA = 0x00002000
+
+VTF_VERSION = (7, 2)
+HEADER_SIZE = 80 # The 7.2 header is 65 bytes, padded to 16 byte alignment like VTFLib does
+HEADER_STRUCT = struct.Struct("<4s2IIHHIHH4x3f4xfIBiBBH")
+THUMBNAIL_SIZE = 16
+REFLECTIVITY_SIZE = 256 # Largest mip level used to compute the reflectivity
+BLOCK_CHUNK = 1 << 15 # Blocks compressed per step, keeps the float temporaries small on large textures
+
+def parse_format(image_format): # Translate the format names used by export_texture into (format, flags)
+    image_format = image_format or 'RGBA8888'
+    flags = 0
+    if image_format.startswith('DXT1'):
+        vtf_format = IMAGE_FORMAT_DXT1
+    elif image_format.startswith('DXT5'):
+        vtf_format = IMAGE_FORMAT_DXT5
+        flags |= FLAG_EIGHTBITALPHA
+    else:
+        vtf_format = IMAGE_FORMAT_RGBA8888
+        flags |= FLAG_EIGHTBITALPHA
+    if image_format.endswith('Normal'):
+        flags |= FLAG_NORMAL
+    return vtf_format, flags
+
+def to_rgba(image_data): # Make sure we are working with a (height, width, 4) uint8 array
+    image_data = np.asarray(image_data, dtype=np.uint8)
+    if image_data.ndim == 2:
+        image_data = image_data[..., None]
+    channels = image_data.shape[2]
+    if channels == 4:
+        return image_data
+    if channels == 1:
+        image_data = np.repeat(image_data, 3, axis=2)
+    elif channels == 2: # LA
+        image_data = np.concatenate((np.repeat(image_data[..., :1], 3, axis=2), image_data[..., 1:]), axis=2)
+        return image_data
+    alpha = np.full(image_data.shape[:2] + (1,), 255, dtype=np.uint8)
+    return np.concatenate((image_data[..., :3], alpha), axis=2)
+
+def get_mipmap_count(width, height):
+    return max(width, height).bit_length()
+
+def get_blocks(image_data): # Split an RGBA image into (block count, 16, 4) 4x4 blocks, padding the edges by repeating them
+    height, width = image_data.shape[:2]
+    padded_height, padded_width = (height + 3) // 4 * 4, (width + 3) // 4 * 4
+    if (padded_height, padded_width) != (height, width):
+        image_data = np.pad(image_data, ((0, padded_height - height), (0, padded_width - width), (0, 0)), mode='edge')
+    blocks = image_data.reshape(padded_height // 4, 4, padded_width // 4, 4, 4).swapaxes(1, 2)
+    return blocks.reshape(-1, 16, 4)
+
+def from_blocks(blocks, width, height): # Inverse of get_blocks
+    blocks_x, blocks_y = (width + 3) // 4, (height + 3) // 4
+    image_data = blocks.reshape(blocks_y, blocks_x, 4, 4, 4).swapaxes(1, 2).reshape(blocks_y * 4, blocks_x * 4, 4)
+    return image_data[:height, :width]
+
+def pack_565(colors): # (..., 3) float colors in 0-255 to 16 bit RGB565
+    colors = np.clip(colors, 0, 255)
+    r = (colors[..., 0] * 31 / 255 + 0.5).astype(np.uint16)
+    g = (colors[..., 1] * 63 / 255 + 0.5).astype(np.uint16)
+    b = (colors[..., 2] * 31 / 255 + 0.5).astype(np.uint16)
+    return (r << 11) | (g << 5) | b
+
+def unpack_565(packed): # 16 bit RGB565 to (..., 3) int colors in 0-255, the same way hardware expands them
+    packed = packed.astype(np.int32)
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1)
+
+def color_palette(color0, color1): # The four colors of a 4-color mode DXT block
+    c0 = unpack_565(color0)
+    c1 = unpack_565(color1)
+    return np.stack((c0, c1, (2 * c0 + c1) // 3, (c0 + 2 * c1) // 3), axis=-2)
+
+def encode_color_blocks(blocks): # Compress the RGB part of (block count, 16, 4) blocks into 8 byte BC1 color blocks
+    colors = blocks[..., :3].astype(np.float32)
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    axis = np.ones((len(blocks), 3), dtype=np.float32)
+    for _ in range(4): # Power iteration to find the principal axis of every block at once
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1, keepdims=True), 1e-6)
+    projection = np.einsum('nki,ni->nk', centered, axis)
+    block_index = np.arange(len(blocks))
+    endpoint0 = colors[block_index, projection.argmax(axis=1)]
+    endpoint1 = colors[block_index, projection.argmin(axis=1)]
+
+    color0 = pack_565(endpoint0)
+    color1 = pack_565(endpoint1)
+    swap = color0 < color1 # color0 > color1 selects the 4-color mode
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+
+    palette = color_palette(color0, color1).astype(np.float32)
+    distance = np.stack([((colors - palette[:, None, entry]) ** 2).sum(axis=2) for entry in range(4)], axis=2)
+    indices = distance.argmin(axis=2).astype(np.uint32)
+    indices[color0 == color1] = 0 # Single color block, the 3-color mode would treat index 3 as black
+    packed_indices = (indices << (np.arange(16, dtype=np.uint32) * 2)).sum(axis=1, dtype=np.uint32)
+
+    result = np.empty((len(blocks), 8), dtype=np.uint8)
+    result[:, 0:2] = color0.astype('<u2').view(np.uint8).reshape(-1, 2)
+    result[:, 2:4] = color1.astype('<u2').view(np.uint8).reshape(-1, 2)
+    result[:, 4:8] = packed_indices.astype('<u4').view(np.uint8).reshape(-1, 4)
+    return result
+
+def alpha_palette(alpha0, alpha1): # The eight alpha values of a DXT5 alpha block
+    a0 = alpha0.astype(np.int32)[:, None]
+    a1 = alpha1.astype(np.int32)[:, None]
+    steps = np.arange(1, 7)
+    interpolated_8 = ((7 - steps) * a0 + steps * a1) // 7
+    steps = np.arange(1, 5)
+    interpolated_6 = ((5 - steps) * a0 + steps * a1) // 5
+    interpolated_6 = np.concatenate((interpolated_6, np.zeros_like(a0), np.full_like(a0, 255)), axis=1)
+    interpolated = np.where(a0 > a1, interpolated_8, interpolated_6)
+    return np.concatenate((a0, a1, interpolated), axis=1)
+
+def encode_alpha_blocks(blocks): # Compress the alpha of (block count, 16, 4) blocks into 8 byte BC3 alpha blocks
+    alpha = blocks[..., 3]
+    alpha0 = alpha.max(axis=1)
+    alpha1 = alpha.min(axis=1)
+    palette = alpha_palette(alpha0, alpha1)
+    distance = np.abs(alpha[:, :, None].astype(np.int32) - palette[:, None, :])
+    indices = distance.argmin(axis=2).astype(np.uint64)
+    packed_indices = (indices << (np.arange(16, dtype=np.uint64) * 3)).sum(axis=1, dtype=np.uint64)
+
+    result = np.empty((len(blocks), 8), dtype=np.uint8)
+    result[:, 0] = alpha0
+    result[:, 1] = alpha1
+    result[:, 2:8] = packed_indices.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :6]
+    return result
+
+def encode_dxt1(image_data):
+    blocks = get_blocks(image_data)
+    return b"".join(encode_color_blocks(blocks[i:i + BLOCK_CHUNK]).tobytes() for i in range(0, len(blocks), BLOCK_CHUNK))
+
+def encode_dxt5(image_data):
+    blocks = get_blocks(image_data)
+    return b"".join(np.concatenate((encode_alpha_blocks(chunk), encode_color_blocks(chunk)), axis=1).tobytes()
+                    for chunk in (blocks[i:i + BLOCK_CHUNK] for i in range(0, len(blocks), BLOCK_CHUNK)))
+
+def decode_color_blocks(data): # (block count, 8) BC1 color blocks to (block count, 16, 3) colors
+    color0 = data[:, 0:2].copy().view('<u2')[:, 0]
+    color1 = data[:, 2:4].copy().view('<u2')[:, 0]
+    indices = (data[:, 4:8].copy().view('<u4')[:, :1] >> (np.arange(16, dtype=np.uint32) * 2)) & 3
+    palette = color_palette(color0, color1)
+    three_color = color0 <= color1 # Only used by DXT1, DXT5 color blocks are always in 4-color mode
+    return palette, indices, three_color
+
+def decode_dxt1(data, width, height):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 8)
+    palette, indices, three_color = decode_color_blocks(blocks)
+    c0, c1 = palette[:, 0], palette[:, 1]
+    palette[three_color, 2] = (c0[three_color] + c1[three_color]) // 2
+    palette[three_color, 3] = 0
+    colors = np.take_along_axis(palette, indices[..., None].astype(np.intp), axis=1)
+    alpha = np.where(three_color[:, None] & (indices == 3), 0, 255)
+    decoded = np.concatenate((colors, alpha[..., None]), axis=2).astype(np.uint8)
+    return from_blocks(decoded, width, height)
+
+def decode_dxt5(data, width, height):
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)
+    palette, indices, _ = decode_color_blocks(blocks[:, 8:16])
+    colors = np.take_along_axis(palette, indices[..., None].astype(np.intp), axis=1)
+    alpha_indices = np.zeros((len(blocks), 8), dtype=np.uint8)
+    alpha_indices[:, :6] = blocks[:, 2:8]
+    alpha_indices = (alpha_indices.view('<u8')[:, :1] >> (np.arange(16, dtype=np.uint64) * 3)) & 7
+    alpha = np.take_along_axis(alpha_palette(blocks[:, 0], blocks[:, 1]), alpha_indices.astype(np.intp), axis=1)
+    decoded = np.concatenate((colors, alpha[..., None]), axis=2).astype(np.uint8)
+    return from_blocks(decoded, width, height)
+
+def get_image_size(width, height, vtf_format):
+    if vtf_format == IMAGE_FORMAT_DXT1:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * 8
+    if vtf_format == IMAGE_FORMAT_DXT5:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * 16
+    if vtf_format == IMAGE_FORMAT_RGBA8888:
+        return width * height * 4
+    raise ValueError(f"Unsupported VTF image format {vtf_format}")
+
+def encode_image(image_data, vtf_format):
+    if vtf_format == IMAGE_FORMAT_DXT1:
+        return encode_dxt1(image_data)
+    if vtf_format == IMAGE_FORMAT_DXT5:
+        return encode_dxt5(image_data)
+    if vtf_format == IMAGE_FORMAT_RGBA8888:
+        return np.ascontiguousarray(image_data).tobytes()
+    raise ValueError(f"Unsupported VTF image format {vtf_format}")
+
+def decode_image(data, width, height, vtf_format):
+    if vtf_format == IMAGE_FORMAT_DXT1:
+        return decode_dxt1(data, width, height)
+    if vtf_format == IMAGE_FORMAT_DXT5:
+        return decode_dxt5(data, width, height)
+    if vtf_format == IMAGE_FORMAT_RGBA8888:
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)
+    raise ValueError(f"Unsupported VTF image format {vtf_format}")
+
+def is_power_of_two(value):
+    return value > 0 and value & (value - 1) == 0
+
+def compute_reflectivity(image_data): # Average linear color, VTFLib stores this for the engine's radiosity
+    sample = image_data
+    while max(sample.shape[:2]) > REFLECTIVITY_SIZE: # A smaller mip gives (nearly) the same average for a fraction of the cost
+        sample = resample.downsample(sample)
+    linear = (sample[..., :3].astype(np.float32) / 255) ** 2.2
+    return tuple(float(value) for value in linear.reshape(-1, 3).mean(axis=0))
+
+def pack_header(width, height, flags, vtf_format, mipmap_count, reflectivity, thumbnail_width=0, thumbnail_height=0):
+    header = HEADER_STRUCT.pack(b"VTF\0", VTF_VERSION[0], VTF_VERSION[1], HEADER_SIZE,
+                                width, height, flags, 1, 0, *reflectivity, 1.0,
+                                vtf_format, mipmap_count,
+                                IMAGE_FORMAT_DXT1 if thumbnail_width else IMAGE_FORMAT_NONE,
+                                thumbnail_width, thumbnail_height, 1)
+    return header.ljust(HEADER_SIZE, b"\0")
+
+def write_vtf(image_data, vtf_format=IMAGE_FORMAT_RGBA8888, flags=0, resize=True, mipmaps=None): # Encode an RGBA array into the bytes of a VTF file
+    # "mipmaps" is a ready mip chain (largest first, the first level replaces "image_data"), e.g. from resample.generate_mipmaps
+    if mipmaps is None:
+        image_data = to_rgba(image_data)
+        if resize:
+            image_data = resample.resize_power_of_two(image_data)
+        mipmaps = resample.generate_mipmaps(image_data)
+    image_data = mipmaps[0]
+    height, width = image_data.shape[:2]
+    thumbnail = next((mipmap for mipmap in mipmaps if max(mipmap.shape[:2]) <= THUMBNAIL_SIZE), None)
+    if thumbnail is None: # No full mip chain, e.g. for NOMIP textures
+        thumbnail = mipmaps[-1]
+        while max(thumbnail.shape[:2]) > THUMBNAIL_SIZE:
+            thumbnail = resample.downsample(thumbnail)
+
+    parts = [pack_header(width, height, flags, vtf_format, len(mipmaps), compute_reflectivity(image_data),
+                         thumbnail.shape[1], thumbnail.shape[0]),
+             encode_dxt1(thumbnail)]
+    for mipmap in reversed(mipmaps): # VTF stores the smallest mip first
+        parts.append(encode_image(mipmap, vtf_format))
+    return b"".join(parts)
+
+def save_vtf(path, image_data, vtf_format=IMAGE_FORMAT_RGBA8888, flags=0, resize=True, mipmaps=None):
+    data = write_vtf(image_data, vtf_format, flags, resize, mipmaps)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+class VTFStreamWriter: # Encodes a power-of-two texture that arrives as bands of rows (top to bottom), only a few rows per mip level are kept in memory
+    def __init__(self, width, height, vtf_format=IMAGE_FORMAT_RGBA8888, flags=0, spool_size=64 << 20):
+        if not (is_power_of_two(width) and is_power_of_two(height)):
+            raise ValueError(f"Streamed textures need power of two dimensions, got {width}x{height}")
+        self.width = width
+        self.height = height
+        self.vtf_format = vtf_format
+        self.flags = flags
+        self.level_sizes = [(max(1, width >> level), max(1, height >> level)) for level in range(get_mipmap_count(width, height))]
+        self.pending = [[] for _ in self.level_sizes] # Rows that don't fill a whole block row yet
+        self.encoded = [tempfile.SpooledTemporaryFile(max_size=spool_size) for _ in self.level_sizes] # Small levels stay in memory, big ones go to disk
+        self.reflectivity_level = next(level for level, size in enumerate(self.level_sizes) if max(size) <= REFLECTIVITY_SIZE)
+        self.thumbnail_level = next(level for level, size in enumerate(self.level_sizes) if max(size) <= THUMBNAIL_SIZE)
+        self.kept = {self.reflectivity_level: [], self.thumbnail_level: []}
+        self.rows_written = 0
+
+    def write_rows(self, rows): # Add the next band of (rows, width, 4) RGBA pixels of the top level
+        rows = to_rgba(rows)
+        if rows.shape[1] != self.width or self.rows_written + len(rows) > self.height:
+            raise ValueError("Rows don't fit the texture")
+        self.rows_written += len(rows)
+        self.push(0, rows)
+
+    def push(self, level, rows, flush=False, keep=True):
+        if keep and level in self.kept:
+            self.kept[level].append(rows)
+        pending = self.pending[level]
+        pending.append(rows)
+        data = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        ready = len(data) if flush else len(data) // 4 * 4 # Whole block rows, which also keeps the row pairs for downsampling intact
+        pending.clear()
+        if ready < len(data):
+            pending.append(data[ready:])
+        if ready:
+            self.encoded[level].write(encode_image(data[:ready], self.vtf_format))
+            if level + 1 < len(self.level_sizes):
+                self.push(level + 1, resample.downsample(data[:ready]))
+
+    def finish(self): # Encode the rows left over in the smallest levels
+        if self.rows_written != self.height:
+            raise ValueError(f"Only {self.rows_written} of {self.height} rows were written")
+        for level in range(len(self.level_sizes)):
+            if self.pending[level]:
+                self.push(level, self.pending[level].pop(), flush=True, keep=False) # Already kept when it first arrived
+
+    def save(self, f): # Write the finished VTF into the binary file object "f"
+        self.finish()
+        reflectivity_data = np.concatenate(self.kept[self.reflectivity_level])
+        thumbnail = np.concatenate(self.kept[self.thumbnail_level])
+        f.write(pack_header(self.width, self.height, self.flags, self.vtf_format, len(self.level_sizes), compute_reflectivity(reflectivity_data),
+                            thumbnail.shape[1], thumbnail.shape[0]))
+        f.write(encode_dxt1(thumbnail))
+        for encoded in reversed(self.encoded): # VTF stores the smallest mip first
+            encoded.seek(0)
+            shutil.copyfileobj(encoded, f)
+            encoded.close()
+
+def read_vtf_header(data): # Parse the header of VTF file bytes (only the first HEADER_SIZE bytes are needed)
+    if len(data) < HEADER_STRUCT.size or data[:4] != b"VTF\0":
+        raise ValueError("Not a VTF file")
+    (_, version_major, version_minor, header_size, width, height, flags, frames, first_frame,
+     reflectivity_r, reflectivity_g, reflectivity_b, bumpmap_scale, vtf_format, mipmap_count,
+     thumbnail_format, thumbnail_width, thumbnail_height, depth) = HEADER_STRUCT.unpack_from(data)
+    if (version_major, version_minor) < (7, 2):
+        depth = 1
+    return {
+        "version": (version_major, version_minor),
+        "header_size": header_size,
+        "width": width,
+        "height": height,
+        "flags": flags,
+        "frames": frames,
+        "first_frame": first_frame,
+        "reflectivity": (reflectivity_r, reflectivity_g, reflectivity_b),
+        "bumpmap_scale": bumpmap_scale,
+        "format": vtf_format,
+        "mipmap_count": mipmap_count,
+        "thumbnail_format": thumbnail_format,
+        "thumbnail_width": thumbnail_width,
+        "thumbnail_height": thumbnail_height,
+        "depth": depth,
+    }
+
+def read_vtf(data): # Decode a single frame VTF written by write_vtf, returns the header and the mip chain (largest first)
+    header = read_vtf_header(data)
+    offset = header["header_size"]
+    if header["thumbnail_format"] != IMAGE_FORMAT_NONE:
+        offset += get_image_size(header["thumbnail_width"], header["thumbnail_height"], header["thumbnail_format"])
+    mipmaps = []
+    for level in reversed(range(header["mipmap_count"])):
+        width, height = max(1, header["width"] >> level), max(1, header["height"] >> level)
+        size = get_image_size(width, height, header["format"])
+        if offset + size > len(data):
+            raise ValueError("VTF file is truncated")
+        mipmaps.append(decode_image(data[offset:offset + size], width, height, header["format"]))
+        offset += size
+    return header, mipmaps[::-1]